@@ -0,0 +1,112 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from synthetic import ROOT, SEED_CSV, make_synthetic_lineage
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")  # Draw without a display
+
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QPixmap, QPainter, QFont, QColor, QFontMetrics, QStaticText
+
+from label_overlay import GlyphAtlas
+from lineage_store import build_cell_table, build_step_map
+
+# This benchmark times drawing the cell ID overlay of one step
+# "text" draws every label with drawStaticText on the full resolution image and scales the result, as draw_cell_ids used to
+# "layer" builds the step's layer of labels from the glyph atlas, and "redraw" lays a cached layer over the scaled image,
+# which is all draw_cell_ids does once the layer of a step is cached
+# Run it with: python benchmarks/bench_draw.py --cells 1000 5000 10000
+
+UM_PER_PIXEL = 0.144
+FRAME_BUDGET_MS = 16.0
+SHOWN_SIZE = (900, 700) # Size of the window the image is scaled to
+IMAGE = os.path.join(ROOT, "raw_images", "exp1_scene1_t0097.tif")
+
+
+FONT = QFont('Arial', 5)
+
+
+def draw_text(image, labels, points):
+    pixmap = image.copy()
+    painter = QPainter(pixmap)
+    painter.setPen(QColor(255, 255, 255))
+    painter.setFont(FONT)
+    for label, (x, y) in zip(labels, points.tolist()):
+        painter.drawStaticText(x, y, label)
+    painter.end()
+    return pixmap.scaled(*SHOWN_SIZE, Qt.KeepAspectRatio)
+
+
+def draw_layer(frame, atlas, ids, points, scale):
+    layer = atlas.layer(frame.size(), ids, points, scale)
+    pixmap = QPixmap(frame)
+    painter = QPainter(pixmap)
+    painter.drawPixmap(0, 0, layer)
+    painter.end()
+    return layer
+
+
+def redraw(frame, layer):
+    pixmap = QPixmap(frame)
+    painter = QPainter(pixmap)
+    painter.drawPixmap(0, 0, layer)
+    painter.end()
+
+
+def median_ms(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return sorted(timings)[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark drawing the cell ID overlay of a single step")
+    parser.add_argument("--cells", type=int, nargs="+", default=[1_000, 5_000, 10_000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    app = QApplication([])
+    image = QPixmap(IMAGE)
+    seed_steps = pd.read_csv(SEED_CSV, usecols=["stepNum"])["stepNum"]
+    last_step_cells = int((seed_steps == seed_steps.max()).sum())
+
+    atlas = GlyphAtlas(FONT, QColor(255, 255, 255))
+    frame = image.scaled(*SHOWN_SIZE, Qt.KeepAspectRatio)
+    scale = frame.width() / image.width()
+
+    print(f"{'cells':>8} {'prepare (ms)':>12} {'text (ms)':>10} {'layer (ms)':>11} {'redraw (ms)':>12} {'budget':>8}")
+    for n_cells in args.cells:
+        # The last step of the seed holds its most cells, so keeping only that step of the tiled lineage gives one crowded step
+        copies = -(-n_cells // last_step_cells)
+        data = make_synthetic_lineage(copies * len(seed_steps), columns=["stepNum", "id", "parent_id", "pos", "ends", "dir"])
+        data = data[data["stepNum"] == data["stepNum"].max()].iloc[:n_cells].reset_index(drop=True)
+        table = build_cell_table(data, UM_PER_PIXEL)
+        step_map = build_step_map(data, table)
+        cells = next(iter(step_map.values()))["cell_ids"]
+
+        # This is the once-per-step work, the same as CellLineageCorrection.step_labels
+        start = time.perf_counter()
+        ids = np.fromiter(cells, dtype=np.int64, count=len(cells))
+        points = table["pos_px"][[cell_data["index"] for cell_data in cells.values()]]
+        points[:, 1] -= QFontMetrics(FONT).ascent()
+        prepare = (time.perf_counter() - start) * 1000
+
+        labels = [QStaticText(str(cell_id)) for cell_id in cells]
+        text = median_ms(lambda: draw_text(image, labels, points), args.repeat)
+        layer = median_ms(lambda: draw_layer(frame, atlas, ids, points, scale), args.repeat)
+        cached = atlas.layer(frame.size(), ids, points, scale)
+        shown = median_ms(lambda: redraw(frame, cached), args.repeat)
+        print(f"{len(cells):>8} {prepare:>12.2f} {text:>10.2f} {layer:>11.2f} {shown:>12.2f} {'ok' if layer <= FRAME_BUDGET_MS else 'over':>8}")
+    app.quit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import argparse
+import time
+
+from synthetic import make_synthetic_lineage
+
+from lineage_store import build_cell_table, build_step_map
+
+# This benchmark compares building the step_map with the old per-row iloc loop against the columnar build in lineage_store
+# Run it with: python benchmarks/bench_load.py --rows 10000 1000000 10000000
+
+
+UM_PER_PIXEL = 0.144
+
+
+# This is the step_map construction open_csv used before the columnar index, kept here as the reference
+def legacy_step_map(temp_data):
+    temp_map = {}
+    for i in range(temp_data.shape[0]):
+        step_num = temp_data.iloc[i, temp_data.columns.get_loc("stepNum")]
+        cell_id = temp_data.iloc[i, temp_data.columns.get_loc("id")]
+        parent_id = temp_data.iloc[i, temp_data.columns.get_loc("parent_id")]
+        pos = temp_data.iloc[i, temp_data.columns.get_loc("pos")]
+
+        if step_num not in temp_map:
+            temp_map[step_num] = {
+                "index": i,
+                "cell_ids": {cell_id: {"index": i, "parent_id": parent_id, "pos": pos}}
+            }
+        else:
+            temp_map[step_num]["cell_ids"][cell_id] = {"index": i, "parent_id": parent_id, "pos": pos}
+    return temp_map
+
+
+def columnar_step_map(temp_data):
+    return build_step_map(temp_data, build_cell_table(temp_data, UM_PER_PIXEL))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark building the step_map from tracking data")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 1_000_000, 10_000_000])
+    parser.add_argument("--legacy-limit", type=int, default=1_000_000, help="Largest size the slow iloc loop is run at")
+    args = parser.parse_args()
+
+    print(f"{'rows':>12} {'legacy (s)':>12} {'columnar (s)':>14} {'speedup':>10}")
+    for n_rows in args.rows:
+        data = make_synthetic_lineage(n_rows, columns=["stepNum", "id", "parent_id", "pos", "ends", "dir"])
+
+        start = time.perf_counter()
+        new_map = columnar_step_map(data)
+        columnar = time.perf_counter() - start
+
+        if n_rows <= args.legacy_limit:
+            start = time.perf_counter()
+            old_map = legacy_step_map(data)
+            legacy = time.perf_counter() - start
+            if old_map != new_map:
+                raise AssertionError(f"step_map mismatch at {n_rows} rows")
+            print(f"{n_rows:>12} {legacy:>12.3f} {columnar:>14.3f} {legacy / columnar:>9.1f}x")
+        else:
+            print(f"{n_rows:>12} {'skipped':>12} {columnar:>14.3f} {'':>10}")
+
+
+if __name__ == "__main__":
+    main()
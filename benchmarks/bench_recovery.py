@@ -0,0 +1,145 @@
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from synthetic import make_synthetic_lineage
+
+from edit_journal import EditJournal
+from lineage_store import LineageStore
+
+# This benchmark runs scripted editing sessions the way the window does: every edit, undo and redo is journaled,
+# the lineage is checked after it, which flushes it, and a snapshot is written every so many edits
+# Each session is left without saving, as a crash would leave it, and recovered from its snapshot and journal,
+# then run again and recovered from the journal alone. Recovering is timed, and the recovered session has to be the one that was left:
+# the same step_map, the same tracking data once flushed, and the same edits to undo, which undo to the same state again
+# The edits rename cells onto ids their step already has, which leaves rows out of the step_map, so the snapshot has to keep track of them
+# Run it with: python benchmarks/bench_recovery.py --rows 100000 --sessions 20 --edits 60 --snapshot-every 7
+
+
+# This function makes one edit like the Change Cell Info button: a new id, an id already in the step or the same id, and a new parent
+def make_edit(store, rng, next_id):
+    steps = sorted(store.step_map)
+    step = rng.choice(steps[1:])
+    cells = sorted(store.step_map[step]["cell_ids"])
+    old_cell_id = rng.choice(cells)
+    kind = rng.random()
+    if kind < 0.3:
+        new_cell_id = next_id
+    elif kind < 0.7:
+        new_cell_id = rng.choice(cells)
+    else:
+        new_cell_id = old_cell_id
+    previous = sorted(store.step_map[steps[steps.index(step) - 1]]["cell_ids"])
+    return {"op": "change", "step": step, "old": old_cell_id, "new": new_cell_id, "parent": rng.choice(previous + [0])}
+
+
+# This function runs one session on the csv file and returns its store and journal, as a crash would leave them
+def run_session(csv_path, args, seed):
+    rng = random.Random(seed)
+    store = LineageStore.load(csv_path)
+    journal = EditJournal(csv_path, args.snapshot_every)
+    store.check()
+    next_id = int(store.data["id"].max()) + 1
+    for _ in range(args.edits):
+        kind = rng.random()
+        if kind < 0.1:
+            changed = journal.undo(store)
+        elif kind < 0.15:
+            changed = journal.redo(store)
+        else:
+            operation = make_edit(store, rng, next_id)
+            next_id += 1
+            changes = []
+            changed = store.apply(operation, changes)
+            journal.record(operation, changes)
+        if changed is not None:
+            store.check(changed)
+            if journal.snapshot_due():
+                journal.write_snapshot(store)
+    journal.close()
+    return store, journal
+
+
+# This function recovers the session left on the csv file the way the window does when it is opened again
+def recover_session(csv_path, args):
+    start = time.perf_counter()
+    store = LineageStore.load(csv_path)
+    journal = EditJournal(csv_path, args.snapshot_every)
+    replay = journal.recover(store, journal.unsaved_records())
+    journal.replay(replay, store)
+    elapsed = time.perf_counter() - start
+    journal.close()
+    return store, journal, len(replay), elapsed
+
+
+# This function returns what a session holds: every step_map entry with its row and parent, and the flushed ids and parent ids
+def session_state(store):
+    store.flush()
+    step_map = {step: {cell_id: (cell_data["index"], cell_data["parent_id"]) for cell_id, cell_data in step_info["cell_ids"].items()}
+                for step, step_info in store.step_map.items()}
+    return step_map, store.data["id"].tolist(), store.data["parent_id"].tolist()
+
+
+# This function returns how the recovered session differs from the one that was left, or None if it does not
+def compare(left, recovered):
+    for name, before, after in zip(("step_map", "ids", "parent ids"), session_state(left[0]), session_state(recovered[0])):
+        if before != after:
+            if name == "step_map":
+                steps = [step for step in before if before[step] != after.get(step)]
+                return f"{len(steps)} steps of the step_map differ, the first is step {steps[0]}"
+            return f"the {name} of {sum(a != b for a, b in zip(before, after))} rows differ"
+
+    # The recovered undo history only reaches back to the snapshot, it has to end with the same edits
+    undo_stack = recovered[1].undo_stack
+    if [operation for operation, _ in left[1].undo_stack[len(left[1].undo_stack) - len(undo_stack):]] != [operation for operation, _ in undo_stack]:
+        return "the edits to undo differ"
+    for store, journal in (left, recovered):
+        for _, changes in reversed(journal.undo_stack[len(journal.undo_stack) - len(undo_stack):]):
+            store.undo(changes)
+    if session_state(left[0]) != session_state(recovered[0]):
+        return "undoing the recovered edits gives a different state"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark recovering edits after a crash and check the recovered session")
+    parser.add_argument("--rows", type=int, default=None, help="Tile the seed csv to this many rows, the seed itself by default")
+    parser.add_argument("--sessions", type=int, default=20, help="Number of sessions, each with its own edits")
+    parser.add_argument("--edits", type=int, default=60, help="Number of edits, undos and redos in a session")
+    parser.add_argument("--snapshot-every", type=int, default=7, help="Edits between snapshots")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="lineage_recovery_")
+    try:
+        csv_path = os.path.join(directory, "tracking.csv")
+        make_synthetic_lineage(args.rows).to_csv(csv_path, index=False)
+        timings = {"snapshot": [], "journal": []}
+        failures = []
+        for session in range(args.sessions):
+            for how in ("snapshot", "journal"):
+                left = run_session(csv_path, args, args.seed + session)
+                if how == "journal" and os.path.exists(csv_path + ".snapshot.npz"):
+                    os.remove(csv_path + ".snapshot.npz")
+                store, journal, replayed, elapsed = recover_session(csv_path, args)
+                timings[how].append(elapsed)
+                difference = compare(left, (store, journal))
+                if difference is not None:
+                    failures.append(f"session {session}, recovered from the {how} with {replayed} edits replayed: {difference}")
+                journal.discard()
+    finally:
+        shutil.rmtree(directory)
+
+    for how, durations in timings.items():
+        durations.sort()
+        print(f"recovered from the {how:<8}: {durations[len(durations) // 2] * 1000:8.1f} ms median, {durations[-1] * 1000:.1f} ms max")
+    if failures:
+        raise SystemExit(f"{len(failures)} of {2 * args.sessions} recoveries differ from the session that was left, the first: {failures[0]}")
+    print(f"Every one of the {2 * args.sessions} recovered sessions matched the session that was left")
+
+
+if __name__ == "__main__":
+    main()
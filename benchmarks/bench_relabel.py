@@ -0,0 +1,112 @@
+import argparse
+import copy
+import random
+import time
+
+from synthetic import make_synthetic_lineage
+
+from lineage_store import build_cell_table, build_step_map, build_edit_index, relabel_cell, reparent_cell
+
+# This benchmark replays scripted relabel and reparent operations, the edits change_cell_info makes,
+# with the old scan over every later step and with the reverse index in lineage_store
+# Run it with: python benchmarks/bench_relabel.py --ops 3000
+
+UM_PER_PIXEL = 0.144
+
+
+# This is the edit change_cell_info made before the reverse index, kept here as the reference
+def legacy_change_cell(step_map, current_step, old_cell_id, new_cell_id, new_parent_id):
+    if new_cell_id != old_cell_id:
+        for step, step_data in step_map.items():
+            if step < current_step:
+                continue
+            cell_ids = list(step_data["cell_ids"].keys())
+            for cell_id in cell_ids:
+                if cell_id == old_cell_id:
+                    step_data["cell_ids"][new_cell_id] = step_data["cell_ids"].pop(old_cell_id)
+                elif step_data["cell_ids"][cell_id]["parent_id"] == old_cell_id:
+                    step_data["cell_ids"][cell_id]["parent_id"] = new_cell_id
+
+    if new_parent_id != step_map[current_step]["cell_ids"][new_cell_id]["parent_id"]:
+        for step, step_data in step_map.items():
+            if step < current_step:
+                continue
+            cell_ids = list(step_data["cell_ids"].keys())
+            for cell_id in cell_ids:
+                if cell_id == new_cell_id:
+                    step_data["cell_ids"][cell_id]["parent_id"] = new_parent_id
+
+
+# This is the same edit made through the reverse index, the way change_cell_info makes it now
+def indexed_change_cell(step_map, index, current_step, old_cell_id, new_cell_id, new_parent_id):
+    if new_cell_id != old_cell_id:
+        relabel_cell(step_map, index, current_step, old_cell_id, new_cell_id)
+    if new_parent_id != step_map[current_step]["cell_ids"][new_cell_id]["parent_id"]:
+        reparent_cell(step_map, index, current_step, new_cell_id, new_parent_id)
+
+
+# This writes a script of edits a user could make: pick a step and one of its cells, then give it a fresh id,
+# an id from the step before, or keep the id and change only the parent
+# A cell never becomes its own parent, since the old scan handles that case depending on dict order
+def make_script(step_map, n_ops, seed):
+    rng = random.Random(seed)
+    step_map = copy.deepcopy(step_map)
+    index = build_edit_index(step_map)
+    steps = sorted(step_map)
+    next_id = max(max(step_data["cell_ids"]) for step_data in step_map.values()) + 1
+
+    script = []
+    for _ in range(n_ops):
+        step = rng.choice(steps[1:])
+        cells = step_map[step]["cell_ids"]
+        old_cell_id = rng.choice(list(cells))
+        previous_ids = [cell_id for cell_id in step_map.get(step - 1, {"cell_ids": {}})["cell_ids"] if cell_id != cells[old_cell_id]["parent_id"]]
+        kind = rng.random()
+        if kind < 0.4 or not previous_ids:
+            new_cell_id, next_id = next_id, next_id + 1
+        elif kind < 0.6:
+            new_cell_id = rng.choice(previous_ids)
+        else:
+            new_cell_id = old_cell_id
+        new_parent_id = rng.choice([cell_id for cell_id in previous_ids if cell_id != new_cell_id] + [0])
+
+        script.append((step, old_cell_id, new_cell_id, new_parent_id))
+        indexed_change_cell(step_map, index, *script[-1])
+    return script
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark replaying relabel and reparent edits on the step_map")
+    parser.add_argument("--rows", type=int, default=None, help="Tile the seed csv to this many rows, the seed itself by default")
+    parser.add_argument("--ops", type=int, default=3000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    data = make_synthetic_lineage(args.rows, columns=["stepNum", "id", "parent_id", "pos", "ends", "dir"])
+    step_map = build_step_map(data, build_cell_table(data, UM_PER_PIXEL))
+    script = make_script(step_map, args.ops, args.seed)
+
+    legacy_map = copy.deepcopy(step_map)
+    start = time.perf_counter()
+    for op in script:
+        legacy_change_cell(legacy_map, *op)
+    legacy = time.perf_counter() - start
+
+    indexed_map = copy.deepcopy(step_map)
+    start = time.perf_counter()
+    index = build_edit_index(indexed_map)
+    built = time.perf_counter() - start
+    for op in script:
+        indexed_change_cell(indexed_map, index, *op)
+    indexed = time.perf_counter() - start
+
+    if legacy_map != indexed_map:
+        raise AssertionError("The indexed edits did not produce the same step_map as the legacy edits")
+    print(f"{len(data)} rows, {len(script)} edits")
+    print(f"legacy scan:   {legacy:.3f} s ({legacy / len(script) * 1e6:.0f} us per edit)")
+    print(f"reverse index: {indexed:.3f} s ({(indexed - built) / len(script) * 1e6:.0f} us per edit, index built in {built:.3f} s)")
+    print(f"speedup:       {legacy / indexed:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
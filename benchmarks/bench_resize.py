@@ -0,0 +1,65 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+import synthetic  # Puts the repository on the import path
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")  # Scale without a display
+
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import Qt
+
+from frame_cache import FrameCache
+from frame_source import plane_to_image
+
+# This benchmark times scaling one large frame to a sequence of window sizes, like dragging the window edge
+# "full" scales the full resolution frame for every size without filtering, as resizeEvent used to,
+# and "full smooth" does the same with the filtering scaled_pixmap uses
+# "pyramid" scales from the nearest pyramid level, as FrameCache.scaled_pixmap does, and "build" is the one-off cost of the pyramid
+# Run it with: python benchmarks/bench_resize.py --size 4096 --steps 40
+
+FRAME_BUDGET_MS = 16.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark scaling a large frame to many window sizes")
+    parser.add_argument("--size", type=int, default=4096, help="Width and height of the frame in pixels")
+    parser.add_argument("--steps", type=int, default=40, help="Number of window sizes between 400 and 1600 pixels")
+    args = parser.parse_args()
+
+    app = QApplication([])
+    rng = np.random.default_rng(0)
+    plane = rng.integers(0, 256, (args.size, args.size), dtype=np.uint8)
+    cache = FrameCache(loader=lambda key: plane_to_image(plane))
+
+    start = time.perf_counter()
+    cache.pyramid("frame")
+    build = (time.perf_counter() - start) * 1000
+
+    sizes = np.linspace(400, 1600, args.steps).astype(int).tolist()
+    full = []
+    full_smooth = []
+    pyramid = []
+    for size in sizes:
+        start = time.perf_counter()
+        cache.pixmap("frame").scaled(size, size, Qt.KeepAspectRatio)
+        full.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        cache.pixmap("frame").scaled(size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        full_smooth.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        cache.scaled_pixmap("frame", size, size)
+        pyramid.append((time.perf_counter() - start) * 1000)
+
+    print(f"{'frame':>10} {'build (ms)':>11} {'full (ms)':>10} {'full smooth (ms)':>17} {'pyramid (ms)':>13} {'budget':>8}")
+    median = sorted(pyramid)[len(pyramid) // 2]
+    print(f"{args.size:>10} {build:>11.1f} {sorted(full)[len(full) // 2]:>10.1f} {sorted(full_smooth)[len(full_smooth) // 2]:>17.1f} "
+          f"{median:>13.1f} {'ok' if median <= FRAME_BUDGET_MS else 'over':>8}")
+    cache.close()
+    app.quit()
+
+
+if __name__ == "__main__":
+    main()
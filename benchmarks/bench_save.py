@@ -0,0 +1,65 @@
+import argparse
+import os
+import tempfile
+import time
+
+from synthetic import make_synthetic_lineage
+
+from lineage_store import build_cell_table, build_step_map, mark_dirty, apply_dirty, save_table
+
+# This benchmark times saving after a handful of edits: the old write-back of every cell against the dirty rows only,
+# followed by writing the table as csv, Parquet and Feather
+# Run it with: python benchmarks/bench_save.py --rows 1000000 10000000
+
+UM_PER_PIXEL = 0.144
+
+
+# This is the write-back save_csv did before dirty tracking, kept here as the reference
+def legacy_write_back(data, step_map):
+    for step_num, step_info in step_map.items():
+        for cell_id, cell_info in step_info['cell_ids'].items():
+            index = cell_info['index']
+            data.iloc[index, data.columns.get_loc("id")] = cell_id
+            data.iloc[index, data.columns.get_loc("parent_id")] = cell_info['parent_id']
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark writing edits back to the tracking data and saving it")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000, 10_000_000])
+    parser.add_argument("--edits", type=int, default=5000, help="Number of edited cells")
+    parser.add_argument("--legacy-limit", type=int, default=100_000, help="Largest size the old write-back is run at")
+    args = parser.parse_args()
+
+    print(f"{'rows':>12} {'legacy (s)':>11} {'dirty (s)':>10} {'csv (s)':>9} {'parquet (s)':>12} {'feather (s)':>12}")
+    for n_rows in args.rows:
+        data = make_synthetic_lineage(n_rows)
+        step_map = build_step_map(data, build_cell_table(data, UM_PER_PIXEL))
+
+        # Give every edited cell a new parent, spread evenly over the lineage
+        dirty = {}
+        cells = [(cell_id, cell_data) for step_data in step_map.values() for cell_id, cell_data in step_data["cell_ids"].items()]
+        for cell_id, cell_data in cells[::max(1, len(cells) // args.edits)]:
+            cell_data["parent_id"] = cell_id + 1
+            mark_dirty(dirty, cell_id, cell_data)
+
+        legacy = f"{timed(legacy_write_back, data.copy(), step_map):.3f}" if n_rows <= args.legacy_limit else "skipped"
+        write_back = timed(apply_dirty, data, dirty)
+
+        writes = []
+        with tempfile.TemporaryDirectory() as directory:
+            for extension in (".csv", ".parquet", ".feather"):
+                try:
+                    writes.append(f"{timed(save_table, data, os.path.join(directory, 'lineage' + extension)):.3f}")
+                except ImportError:
+                    writes.append("no pyarrow")
+        print(f"{n_rows:>12} {legacy:>11} {write_back:>10.3f} {writes[0]:>9} {writes[1]:>12} {writes[2]:>12}")
+
+
+if __name__ == "__main__":
+    main()
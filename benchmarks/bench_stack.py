@@ -0,0 +1,76 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+import synthetic  # Puts the repository on the import path
+
+from frame_source import TiffPages, open_stack_array
+
+# This benchmark writes a compressed multi-page TIFF, which cannot be memory-mapped and is read through TiffPages,
+# and reads its planes from two threads at once like the GUI thread and the image cache prefetch thread do
+# Every plane read is compared with the plane written, so it also checks the shared file handle is not read from two threads at a time
+# It needs tifffile: pip install tifffile
+# Run it with: python benchmarks/bench_stack.py --frames 50 --size 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark reading a compressed TIFF stack from two threads")
+    parser.add_argument("--frames", type=int, default=50, help="Number of planes in the stack")
+    parser.add_argument("--size", type=int, default=1024, help="Width and height of a plane in pixels")
+    parser.add_argument("--reads", type=int, default=200, help="Number of plane reads per thread")
+    args = parser.parse_args()
+
+    import tifffile
+
+    rng = np.random.default_rng(0)
+    # Smooth planes with a little noise compress about as well as microscope images do
+    ramp = np.add.outer(np.arange(args.size), np.arange(args.size)).astype(np.uint16)
+    stack = np.stack([ramp + np.uint16(i) + rng.integers(0, 16, ramp.shape, dtype=np.uint16) for i in range(args.frames)])
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "stack.tif")
+        tifffile.imwrite(path, stack, compression="zlib")
+        planes = open_stack_array(path)
+        if not isinstance(planes, TiffPages):
+            raise SystemExit("The stack was memory-mapped, it should have been read page by page")
+
+        errors = []
+        durations = []
+
+        def read_planes(seed):
+            order = np.random.default_rng(seed).integers(0, len(planes), args.reads)
+            for index in order.tolist():
+                start = time.perf_counter()
+                try:
+                    plane = planes[index]
+                except Exception as error:
+                    errors.append(f"plane {index}: {error!r}")
+                    continue
+                durations.append(time.perf_counter() - start)
+                if not np.array_equal(plane, stack[index]):
+                    errors.append(f"plane {index} does not match")
+
+        threads = [threading.Thread(target=read_planes, args=(seed,)) for seed in range(2)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        total = time.perf_counter() - start
+        planes.close()
+
+    durations.sort()
+    print(f"{args.frames} planes of {args.size}x{args.size}, {len(durations)} reads from 2 threads in {total * 1000:.0f} ms")
+    if durations:
+        print(f"plane read: {durations[len(durations) // 2] * 1000:.2f} ms median, {durations[-1] * 1000:.2f} ms max")
+    if errors:
+        raise SystemExit(f"{len(errors)} bad reads, the first was {errors[0]}")
+    print("Every plane read matched the stack")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import argparse
+import random
+import time
+
+from synthetic import make_synthetic_lineage, repeat_in_time
+
+from lineage_store import LineageStore
+
+# This benchmark times the lineage validator on a synthetic lineage: the old loop over the step_map,
+# the array checks over every row, and the incremental check of the steps one edit changed
+# "cells" tiles more cells into every step, "frames" runs the lineage again and again in time, so steps stay small
+# Run it with: python benchmarks/bench_validate.py --rows 1000000 --layout cells frames
+
+COLUMNS = ["stepNum", "id", "parent_id", "divideFlag", "pos"]
+
+
+# This is the check validate made before the array checks, kept here as the reference
+# It only looked for orphan parents and parent changes
+def legacy_validate(step_map):
+    problems = []
+    parents = {}
+    previous_ids = set()
+    for step in sorted(step_map):
+        cells = step_map[step]["cell_ids"]
+        for cell_id, cell_data in cells.items():
+            parent_id = cell_data["parent_id"]
+            if cell_id not in parents:
+                parents[cell_id] = parent_id
+                if parent_id != 0 and parent_id not in previous_ids:
+                    problems.append({"step": step, "id": cell_id, "problem": f"parent {parent_id} is not in step {step - 1}"})
+            elif parents[cell_id] != parent_id:
+                problems.append({"step": step, "id": cell_id, "problem": f"parent changed from {parents[cell_id]} to {parent_id}"})
+                parents[cell_id] = parent_id
+        previous_ids = set(cells)
+    return problems
+
+
+# This function times the three checks on one store
+def run(store, layout, args):
+    print(f"\n{layout}: {len(store.data)} rows, {len(store.step_map)} steps")
+
+    start = time.perf_counter()
+    legacy_validate(store.step_map)
+    legacy = time.perf_counter() - start
+
+    start = time.perf_counter()
+    found = store.check()
+    full = time.perf_counter() - start
+
+    rng = random.Random(args.seed)
+    steps = sorted(store.step_map)
+    next_id = int(store.data["id"].max()) + 1
+    incremental = []
+    for _ in range(args.edits):
+        step = rng.choice(steps[1:])
+        cell_id = rng.choice(list(store.step_map[step]["cell_ids"]))
+        changed = store.relabel(step, cell_id, next_id)
+        next_id += 1
+        start = time.perf_counter()
+        store.check(changed)
+        incremental.append(time.perf_counter() - start)
+
+    incremental.sort()
+    print(f"legacy loop:       {legacy * 1000:8.1f} ms (orphans and parent changes only)")
+    print(f"array checks:      {full * 1000:8.1f} ms ({len(found)} problems)")
+    print(f"incremental check: {incremental[len(incremental) // 2] * 1000:8.1f} ms median, {incremental[-1] * 1000:.1f} ms max over {len(incremental)} edits")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark validating a lineage after edits")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Tile the seed csv to this many rows")
+    parser.add_argument("--edits", type=int, default=50, help="Number of edits checked incrementally")
+    parser.add_argument("--layout", nargs="+", choices=["cells", "frames"], default=["cells"], help="How the seed csv is scaled up")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for layout in args.layout:
+        if layout == "cells":
+            data = make_synthetic_lineage(args.rows, columns=COLUMNS)
+        else:
+            seed = make_synthetic_lineage(columns=COLUMNS)
+            data = repeat_in_time(seed, -(-args.rows // len(seed))).iloc[:args.rows]
+        run(LineageStore(data), layout, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Only on Unix, the peak memory is left out elsewhere
+    resource = None
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")  # Run the window without a display
+os.environ["LINEAGE_PERF"] = "1"  # Turns the timing hooks on, it has to be set before perf is imported
+
+import numpy as np
+import pandas as pd
+
+from synthetic import ROOT, SEED_CSV, make_synthetic_lineage, repeat_in_time
+
+from PyQt5.QtWidgets import QApplication, QFileDialog, QMessageBox
+from PyQt5.QtGui import QImage
+
+import perf
+from frame_source import plane_to_image
+
+# This is the headless benchmark suite: it builds synthetic experiments scaled up from tracking_data_original.csv and raw_images/,
+# opens each one in the real window on Qt's offscreen platform and times the hot paths through the hooks in perf
+# "cells xN" tiles N colonies into every step and tiles the images so they hold them, "frames xN" runs the lineage N times in a row
+# For every experiment it opens the csv file, opens it again from the lineage cache, steps through images, edits cells and saves
+# Run it with: python benchmarks/run_suite.py --scales 10 100 1000 --json results.json
+# and compare a later run against it with: python benchmarks/run_suite.py --scales 10 100 1000 --baseline results.json
+
+RAW_IMAGES = os.path.join(ROOT, "raw_images")
+
+
+# This writes the images of an experiment: unique_frames distinct frames, each a grid of tiles x tiles raw images,
+# and one file per step linking to them in turn, so a long experiment does not need a file of its own for every frame
+def write_frames(directory, n_steps, tiles, unique_frames):
+    names = sorted(f for f in os.listdir(RAW_IMAGES) if f.lower().endswith(".tif"))[:unique_frames]
+    frames = []
+    os.makedirs(os.path.join(directory, "unique"))
+    for i, name in enumerate(names):
+        image = QImage(os.path.join(RAW_IMAGES, name)).convertToFormat(QImage.Format_Grayscale16)
+        bits = image.constBits()
+        bits.setsize(image.sizeInBytes())
+        plane = np.frombuffer(bits, dtype=np.uint16).reshape(image.height(), image.bytesPerLine() // 2)[:, :image.width()]
+        frames.append(os.path.join(directory, "unique", f"frame_{i}.tif"))
+        plane_to_image(np.tile(plane, (tiles, tiles))).save(frames[-1])
+
+    images = os.path.join(directory, "images")
+    os.makedirs(images)
+    for step in range(n_steps):
+        link = os.path.join(images, f"frame_{step:07d}.tif")
+        try:
+            os.symlink(frames[step % len(frames)], link)
+        except OSError:  # Links need extra rights on some systems
+            shutil.copyfile(frames[step % len(frames)], link)
+    return images, QImage(frames[0]).size()
+
+
+# This builds the tracking data of one experiment
+def make_lineage(axis, scale):
+    seed = pd.read_csv(SEED_CSV)
+    if axis == "cells":
+        return make_synthetic_lineage(len(seed) * scale)
+    return repeat_in_time(seed, scale)
+
+
+# This runs the window through one experiment and returns what was timed
+def run_experiment(app, window_class, directory, csv_path, images, args):
+    QFileDialog.getExistingDirectory = staticmethod(lambda *a, **k: images)
+    QFileDialog.getOpenFileName = staticmethod(lambda *a, **k: (csv_path, ""))
+    QFileDialog.getSaveFileName = staticmethod(lambda *a, **k: (os.path.join(directory, "saved.csv"), "CSV Files (*.csv)"))
+
+    perf.reset()
+    window = window_class()
+    window.resize(1200, 900)
+    window.open_directory()
+
+    # The first open parses the csv file and writes its cache, the second one reads the cache
+    for _ in range(2):
+        window.open_csv()
+        while window.loader is not None:
+            app.processEvents()
+            time.sleep(0.001)
+        if window.cache_writer is not None:
+            window.cache_writer.join()
+
+    for _ in range(min(args.steps_shown, len(window.file_list) - 1)):
+        with perf.measure("next_image"):
+            window.next_image()
+        app.processEvents()
+
+    # Each edit renames a cell of the shown step to a new id or gives it parent 0, like a user correcting the tracking
+    rng = random.Random(args.seed)
+    next_id = int(window.store.data["id"].max()) + 1
+    for i in range(args.edits):
+        cells = window.step_map[window.file_counter + 1]["cell_ids"]
+        cell_id = rng.choice(sorted(cells))
+        window.Choose_Cell.setCurrentText(str(cell_id))
+        if i % 2 == 0:
+            window.Cell_ID.setText(str(next_id))
+            next_id += 1
+        else:
+            window.Cell_Parent.setText("0")
+        window.change_cell_info()
+        app.processEvents()
+
+    window.save_csv()
+    window.close()
+    app.processEvents()
+    return perf.summary()
+
+
+# This function returns the operations that got slower than in the baseline, by more than tolerance and one millisecond
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+    for case, result in results.items():
+        for name, stats in result["stats"].items():
+            before = baseline.get(case, {}).get("stats", {}).get(name)
+            if before is None:
+                continue
+            if stats["p50_ms"] > before["p50_ms"] * (1 + tolerance) and stats["p50_ms"] - before["p50_ms"] > 1.0:
+                regressions.append((case, name, before["p50_ms"], stats["p50_ms"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the hot paths on synthetic experiments scaled up from the sample data")
+    parser.add_argument("--scales", type=int, nargs="+", default=[10, 100, 1000], help="How many times larger than the sample data")
+    parser.add_argument("--axes", nargs="+", choices=["cells", "frames"], default=["cells", "frames"], help="Scale the cells per step, the number of steps, or both in turn")
+    parser.add_argument("--steps-shown", type=int, default=20, help="Number of images stepped through")
+    parser.add_argument("--edits", type=int, default=20, help="Number of Change Cell Info edits")
+    parser.add_argument("--unique-frames", type=int, default=4, help="Number of distinct frames written, the steps link to them in turn")
+    parser.add_argument("--max-frame-pixels", type=float, default=64e6, help="Largest tiled frame, larger scales keep this frame size")
+    parser.add_argument("--workdir", help="Directory for the generated experiments, a temporary one by default")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated experiments")
+    parser.add_argument("--json", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file of an earlier run, operations that got slower are reported and the exit status is 1")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown against the baseline, 0.25 is 25%%")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    app = QApplication([])
+    QMessageBox.information = staticmethod(lambda *a, **k: None)
+    QMessageBox.warning = staticmethod(lambda parent, title, text, *a, **k: print(f"{title}: {text}"))
+    QMessageBox.question = staticmethod(lambda *a, **k: QMessageBox.No)
+    os.chdir(ROOT)  # The window loads its .ui file from the working directory
+    from cell_lineage_correction import CellLineageCorrection
+
+    raw = QImage(os.path.join(RAW_IMAGES, sorted(os.listdir(RAW_IMAGES))[0]))
+    max_tiles = max(1, int(math.sqrt(args.max_frame_pixels / (raw.width() * raw.height()))))
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="lineage_suite_")
+    results = {}
+    try:
+        for scale in args.scales:
+            for axis in args.axes:
+                case = f"{axis} x{scale}"
+                directory = os.path.join(workdir, case.replace(" ", "_"))
+                if os.path.isdir(directory):
+                    shutil.rmtree(directory)
+                os.makedirs(directory)
+
+                data = make_lineage(axis, scale)
+                csv_path = os.path.join(directory, "tracking.csv")
+                data.to_csv(csv_path, index=False)
+                tiles = min(math.ceil(math.sqrt(scale)), max_tiles) if axis == "cells" else 1
+                n_steps = int(data["stepNum"].max())
+                images, frame_size = write_frames(directory, n_steps, tiles, args.unique_frames)
+                info = {"rows": len(data), "steps": n_steps, "max_cells_per_step": int(data["stepNum"].value_counts().max()),
+                        "frame": f"{frame_size.width()}x{frame_size.height()}"}
+                del data
+
+                stats = run_experiment(app, CellLineageCorrection, directory, csv_path, images, args)
+                # The peak of the whole run so far, the largest experiment run last gives the memory it needs
+                memory = ""
+                if resource is not None:
+                    info["peak_memory_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+                    memory = f", {info['peak_memory_mb']:.0f} MB peak memory"
+                results[case] = {"info": info, "stats": stats}
+                print(f"\n{case}: {info['rows']} rows, {info['steps']} steps, up to {info['max_cells_per_step']} cells per step, "
+                      f"{info['frame']} frames{memory}")
+                print(perf.format_summary(stats))
+                perf.reset()
+                if not args.keep:
+                    shutil.rmtree(directory)
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = find_regressions(results, json.load(file), args.tolerance)
+        for case, name, before, after in regressions:
+            print(f"Regression in {case}, {name}: p50 {before:.2f} ms -> {after:.2f} ms")
+        if regressions:
+            sys.exit(1)
+        print("\nNo regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# This makes the modules in the repository root importable when a benchmark is run as a script
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+SEED_CSV = os.path.join(ROOT, "tracking_data_original.csv")
+
+
+# This builds a synthetic lineage with n_rows rows by tiling the seed csv
+# Every copy is an independent colony living in the same steps, so ids and parent_ids are shifted past the previous copy
+# Without n_rows the seed csv is returned as it is
+def make_synthetic_lineage(n_rows=None, seed_csv=SEED_CSV, columns=None):
+    seed = pd.read_csv(seed_csv, usecols=columns)
+    if n_rows is None:
+        n_rows = len(seed)
+    copies = -(-n_rows // len(seed))  # Ceiling division
+    id_span = int(seed["id"].max())
+
+    offsets = np.repeat(np.arange(copies) * id_span, len(seed))
+    data = pd.concat([seed] * copies, ignore_index=True)
+    data["id"] = data["id"].to_numpy() + offsets
+    data["parent_id"] = np.where(data["parent_id"].to_numpy() == 0, 0, data["parent_id"].to_numpy() + offsets)
+
+    # Keep the rows of every step together like the tracker writes them, then cut to the requested size
+    data = data.sort_values("stepNum", kind="stable", ignore_index=True)
+    return data.iloc[:n_rows].reset_index(drop=True)
+
+
+# This makes a lineage copies times as long by running it again after its last step, copies times in a row
+# Every run is a new colony with ids shifted past the previous run, and its first cells have parent 0 like the seed's
+def repeat_in_time(data, copies):
+    if copies <= 1:
+        return data
+    n_steps = int(data["stepNum"].max())
+    id_span = int(data["id"].max())
+    runs = np.repeat(np.arange(copies), len(data))
+    repeated = pd.concat([data] * copies, ignore_index=True)
+    repeated["stepNum"] = repeated["stepNum"].to_numpy() + runs * n_steps
+    repeated["id"] = repeated["id"].to_numpy() + runs * id_span
+    repeated["parent_id"] = np.where(repeated["parent_id"].to_numpy() == 0, 0, repeated["parent_id"].to_numpy() + runs * id_span)
+    return repeated
+
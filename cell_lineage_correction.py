@@ -1,16 +1,27 @@
 import os
+from collections import OrderedDict
+import numpy as np
 import pandas as pd
 import json
 from PyQt5.QtWidgets import *
 from PyQt5 import uic, QtGui
 
-from PyQt5.QtCore import Qt, pyqtSignal, QPoint
-from PyQt5.QtGui import QPainter, QFont, QColor
+from PyQt5.QtCore import Qt, pyqtSignal, QPoint, QTimer
+from PyQt5.QtGui import QPainter, QFont, QColor, QFontMetrics
 
-# This is for the action of adding a cell. It is not currently useful.
+from csv_loader import CsvLoader
+from edit_journal import EditJournal
+from frame_cache import FrameCache
+from frame_source import DirectoryFrameSource, StackFrameSource
+from lineage_cache import read_cache, start_cache_write, export_step_map
+from label_overlay import GlyphAtlas
+from lineage_store import LineageStore, CellGrid, DEFAULT_UM_PER_PIXEL, parse_vector_column, to_pixels, read_step_count, check_id
+from perf import timed, clock, record_since
+
+# This is for selecting a cell by clicking on it, and for the action of adding a cell
 # In a nutshell, it is a label that emits a signal when clicked
 # The signal contains the position of the click
-# The position can then be used to add a cell at that location
+# The position is then used to find the cell under it, or to add a cell at that location
 class ClickableLabel(QLabel):
     clicked = pyqtSignal(QPoint)  # Signal to emit when the label is clicked
     def mousePressEvent(self, event):
@@ -24,46 +35,82 @@ class CellLineageCorrection(QMainWindow):
     # This is the constructor for the class
     def __init__(self):
         super(CellLineageCorrection, self).__init__()
+        # Resize events arrive continuously while the window is dragged, the image is only scaled again once they stop for resize_delay ms
+        self.resize_delay = 50
+        self.resize_timer = QTimer(self)
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.timeout.connect(self.apply_resize)
+        self.frame_cache = FrameCache() # This keeps decoded images in memory so navigating and resizing does not read them from disk again
+        self.prefetch_count = 4 # This is how many images before and after the current one are decoded in the background
         uic.loadUi('Cell_Lineage_Correction.ui', self)  # This loads the promoted ClickableLabel
         self.show() # This shows the window
         self.Image_Container.clicked.connect(self.image_clicked) # This connects the signal to the slot
 
         self.current_file = "default.png" # This is the default image to load on startup, its just a black screen
-        pixmap = QtGui.QPixmap(self.current_file) # Load the current image
+        pixmap = self.frame_cache.pixmap(self.current_file) # Load the current image
         pixmap = pixmap.scaled(self.width(), self.height()) # Scale it to the new window size
         self.Image_Container.setPixmap(pixmap) # Set the image to the container
         self.Image_Container.setMinimumSize(1, 1) # Set the minimum size of the container to 1x1 pixels
 
         # These are the variables that will be used to keep track of the data
-        self.file_list = None # This is the list of files in the directory that you choose
+        self.frame_source = None # This is where the images come from, a directory of images or a single image stack
+        self.file_list = None # This is the list of frame keys of the frame_source, the file paths when a directory is open
         self.file_counter = None # This is the index of the current file in the file_list
         self.image_num = None # This is the size of the file_list
         self.current_csv = None # This is the path to the current csv file
-        self.csv_data = None # This is the data from the current csv file in a pandas dataframe
-        self.step_map = None # This is a dictionary that maps the step number to the index of the row in the csv file. Check step_map.json for an example of what it looks like
+        self.store = None # This is the LineageStore of the current csv file, it holds the data, the step_map and the edits
+        self.step_map = None # This is the step_map of the store, a dictionary that maps the step number to the index of the row in the csv file. Check step_map.json for an example of what it looks like
+        self.journal = None # This records every edit next to the csv file so unsaved edits survive a crash, and holds the undo history
+        self.loader = None # This is the CsvLoader reading the current csv file, None once it is loaded
+        self.load_progress = None # This is the progress dialog shown while the loader runs
+        self.cache_writer = None # This is the thread writing the lineage cache of the csv file that was just loaded
+        self.load_started = None # This is when the current csv file started to open, for the open_csv timing
+        self.label_cache = {} # This maps a step number to the pixel positions and IDs of the labels drawn on its image
+        self.overlay_cache = OrderedDict() # This maps a step number to its layer of labels at the size the image is shown, least recently used first
+        self.overlay_size = None # This is the size of the layers in overlay_cache, they are all dropped when it changes
+        self.max_overlays = 16 # This is how many steps keep their layer of labels
+        self.scaled_frame_cache = (None, None, None) # This is the current image scaled to the window, with its frame key and size
+        self.grid_cache = {} # This maps a step number to the CellGrid used to find the cell under a click
         self.chosen_cell = None # This is the cell that is currently selected in the Choose_Cell combobox
+        self.lineage_root = None # This is the cell whose descendants are drawn when IsolateCell and IsolateDescendants are checked
 
         # These connect the buttons in the file tab to their respective functions
         self.actionOpen_Image.triggered.connect(self.open_image) # Currently, it is better to open a Directory as connecting to a CSV file requires a CSV with the same numhber of images as cells in the CSV. Adding a random image might cause the program to crash.
         self.actionOpen_Directory.triggered.connect(self.open_directory)
+        self.actionOpen_Stack.triggered.connect(self.open_stack)
         self.actionOpen_CSV.triggered.connect(self.open_csv)
         self.actionSave.triggered.connect(self.save_csv)
+        self.actionExport_Step_Map.triggered.connect(self.export_step_map)
+        self.actionUndo.triggered.connect(self.undo_edit)
+        self.actionRedo.triggered.connect(self.redo_edit)
 
         # These connect the buttons to their respective functions
         self.Right_Button.clicked.connect(self.next_image)
         self.Left_Button.clicked.connect(self.previous_image)
         self.Choose_Cell.currentIndexChanged.connect(self.update_chosen_cell)
         self.Change_Cell_Info.clicked.connect(self.change_cell_info)
+        self.Choose_Cell.activated.connect(self.update_lineage_root)
         self.IsolateCell.stateChanged.connect(self.redraw_image)
+        self.IsolateDescendants.stateChanged.connect(self.update_lineage_root)
         
         # This is the default um_per_pixel value for the images
-        self.um_per_pixel = 0.144
+        self.um_per_pixel = DEFAULT_UM_PER_PIXEL
+
+        # A click selects the closest cell if it is at most this many um away, otherwise it adds a new cell
+        self.click_tolerance = 1.5
+
+        # This is the font used to draw the cell IDs on the images, and the atlas of its glyphs the labels are drawn from
+        self.label_font = QFont('Arial', 5)
+        self.glyph_atlas = GlyphAtlas(self.label_font, QColor(255, 255, 255))
 
-    # This function is called when the window is resized
+    # This function is called when the window is resized, it restarts the timer that calls apply_resize
     def resizeEvent(self, event):
+        self.resize_timer.start(self.resize_delay)
+
+    # This function scales the image to the new window size once the window stopped changing size
+    def apply_resize(self):
         try:
-            pixmap = QtGui.QPixmap(self.current_file)  # Load the current image
-            self.Image_Container.setPixmap(pixmap.scaled(self.width(), self.height(), Qt.KeepAspectRatio))  # Scale it to the new window size
+            self.Image_Container.setPixmap(self.scaled_frame())  # Scale the current image to the new window size
             self.draw_cell_ids() # Redraw the cell IDs
             return
         except:
@@ -76,7 +123,7 @@ class CellLineageCorrection(QMainWindow):
         
         if filename != "":
             self.current_file = filename
-            pixmap = QtGui.QPixmap(self.current_file)
+            pixmap = self.frame_cache.pixmap(self.current_file)
             pixmap = pixmap.scaled(self.width(), self.height())
             self.Image_Container.setPixmap(pixmap)
         else:
@@ -87,16 +134,43 @@ class CellLineageCorrection(QMainWindow):
         directory = str(QFileDialog.getExistingDirectory(self, "Select Directory"))
 
         if directory != "":
-            self.file_list = [directory + "/" + f for f in os.listdir(directory) if f.endswith(".png") or f.endswith(".jpg") or f.endswith(".jpeg") or f.endswith(".bmp") or f.endswith(".gif") or f.endswith(".tif") or f.endswith(".tiff")]
-            self.image_num = len(self.file_list) # This is the number of images in the directory
-            self.file_counter = 0 # This is the index of the current image in the file_list
-            self.update_step_label() # This updates the step label to the current step number
-            self.current_file = self.file_list[self.file_counter] # This sets the current image the first image in the file_list
-            pixmap = QtGui.QPixmap(self.current_file) # This loads the current image
-            self.Image_Container.setPixmap(pixmap.scaled(self.width(), self.height(), Qt.KeepAspectRatio)) # This scales the image to the window size
+            self.set_frame_source(DirectoryFrameSource(directory))
         else:
             print("No directory selected")
 
+    # This function is called for opening a single file that holds every image, a multi-page TIFF or a NumPy .npy stack
+    def open_stack(self):
+        options = QFileDialog.Options()
+        filename, _ = QFileDialog.getOpenFileName(self, "Open Image Stack", "", "Image Stacks (*.tif *.tiff *.npy)", options=options)
+
+        if filename != "":
+            try:
+                source = StackFrameSource(filename)
+            except (ImportError, OSError, ValueError) as error:
+                QMessageBox.warning(self, "Cannot Open Stack", str(error))
+                return
+            self.set_frame_source(source)
+        else:
+            print("No file selected")
+
+    # This function shows the first image of a newly opened directory or stack
+    def set_frame_source(self, source):
+        previous = self.frame_source
+        self.frame_source = source
+        self.file_list = source.keys
+        self.image_num = len(self.file_list) # This is the number of images in the directory
+        self.file_counter = 0 # This is the index of the current image in the file_list
+        self.update_step_label() # This updates the step label to the current step number
+        self.current_file = self.file_list[self.file_counter] # This sets the current image the first image in the file_list
+        self.frame_cache.clear(source.load) # Images from a previously opened directory are no longer needed
+        if previous is not None and previous is not source:
+            previous.close() # The prefetch thread no longer decodes from it, a frame it is still reading is dropped
+        self.scaled_frame_cache = (None, None, None)
+        self.overlay_cache.clear() # The labels were laid out for the size the previous images were shown at
+        self.overlay_size = None
+        self.Image_Container.setPixmap(self.scaled_frame()) # This loads the current image scaled to the window size
+        self.prefetch_neighbours()
+
     # This function is called for opening a CSV file that links to the directory selected
     def open_csv(self):
         if self.file_list is None:
@@ -108,41 +182,152 @@ class CellLineageCorrection(QMainWindow):
         filename, _ = QFileDialog.getOpenFileName(self, "Open CSV", "", "CSV Files (*.csv)", options=options)
 
         # If the user cancels the dialog box, filename will be an empty string
-        if filename != "":
-            temp_data = pd.read_csv(filename)
-            value = temp_data.iloc[-1, 0] # This is the number of images in the CSV file
-            
-            # This checks if the number of images in the CSV file matches the number of images in the directory
-            if value != self.image_num:
-                print("CSV file does not match the number of images in the directory, please choose the correct directory or CSV file")
-                return
-            
-            # This creates a dictionary that maps the step number to the index of the row in the csv file
-            temp_map = {}
-            for i in range(temp_data.shape[0]):
-                step_num = temp_data.iloc[i, temp_data.columns.get_loc("stepNum")]
-                cell_id = temp_data.iloc[i, temp_data.columns.get_loc("id")]
-                parent_id = temp_data.iloc[i, temp_data.columns.get_loc("parent_id")]
-                pos = temp_data.iloc[i, temp_data.columns.get_loc("pos")]
-
-                if step_num not in temp_map:
-                    temp_map[step_num] = {
-                        "index": i,
-                        "cell_ids": {cell_id: {"index": i, "parent_id": parent_id, "pos": pos}}
-                    }
-                else:
-                    temp_map[step_num]["cell_ids"][cell_id] = {"index": i, "parent_id": parent_id, "pos": pos}
-        else:
+        if filename == "":
             print("No CSV file selected")
             return
 
+        # This checks if the number of images in the CSV file matches the number of images in the directory
+        # Only the end of the file is read for this, so a wrong file is rejected before any loading starts
+        try:
+            value = read_step_count(filename) # This is the number of images in the CSV file
+        except (OSError, ValueError) as error:
+            QMessageBox.warning(self, "Cannot Open CSV", str(error))
+            return
+        if value != self.image_num:
+            print("CSV file does not match the number of images in the directory, please choose the correct directory or CSV file")
+            return
+        self.load_csv(filename)
+
+    # This function loads a csv file that matches the images, from its lineage cache if it has one
+    def load_csv(self, filename):
+        self.cancel_loading()
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None # Edits are possible again once the file is loaded and the journal is checked
+
+        # A file that was opened before is read from its lineage cache, which only memory-maps the parsed columns
         self.current_csv = filename
-        self.csv_data = temp_data
-        self.step_map = temp_map
+        self.load_started = clock()
+        cached = read_cache(filename, self.um_per_pixel)
+        if cached is not None:
+            self.set_store(cached)
+            self.csv_ready()
+            record_since("open_csv_cached", self.load_started)
+            return
+
+        # Otherwise the file is read in chunks on a worker thread, each step can be viewed as soon as its chunk arrives
+        # Only the columns the viewer needs are read, saving reads the others from the file again
+        self.set_store(LineageStore(um_per_pixel=self.um_per_pixel, path=filename, partial=True))
+
+        self.loader = CsvLoader(filename, self.um_per_pixel, parent=self)
+        self.loader.chunk_loaded.connect(self.add_loaded_chunk)
+        self.loader.loaded.connect(self.finish_loading)
+        self.loader.failed.connect(self.loading_failed)
+        self.load_progress = QProgressDialog("Loading " + os.path.basename(filename), "Cancel", 0, 100, self)
+        self.load_progress.setWindowModality(Qt.NonModal) # The images stay usable while the file loads
+        self.load_progress.setMinimumDuration(500)
+        self.load_progress.canceled.connect(self.cancel_loading)
+        self.loader.progress.connect(self.load_progress.setValue)
+        self.loader.start()
+
+    # This function adds a chunk read by the loader to the store and shows it if it holds the current step
+    def add_loaded_chunk(self, prepared):
+        if self.loader is None or self.sender() is not self.loader:
+            return  # A chunk of a load that was canceled
+        steps = self.store.extend(*prepared)
+        if self.file_counter is not None and self.file_counter + 1 in steps:
+            self.update_cell_list()
+            self.draw_cell_ids()
 
+    # This function completes the store once the loader read the whole file, and caches it for the next time it is opened
+    def finish_loading(self):
+        if self.loader is None or self.sender() is not self.loader:
+            return
+        self.close_loader()
+        self.store.finish()
+        self.cache_writer = start_cache_write(self.current_csv, self.store)
+        self.csv_ready()
+        record_since("open_csv", self.load_started)
+
+    # This function makes a fully loaded csv file editable
+    # If a previous session left unsaved edits for this CSV file, it offers to replay them
+    def csv_ready(self):
+        temp_journal = EditJournal(self.current_csv)
+        records = temp_journal.unsaved_records()
+        replay = None
+        if records:
+            answer = QMessageBox.question(self, "Recover Edits", f"Found {len(records)} unsaved edits for this CSV file. Recover them?")
+            if answer == QMessageBox.Yes:
+                replay = temp_journal.recover(self.store, records)
+            else:
+                temp_journal.discard()
+        self.journal = temp_journal
+
+        if replay is not None:
+            try:
+                self.journal.replay(replay, self.store)
+            except ValueError as error:
+                # The edits before the one that failed are recovered, and the journal now ends with them
+                answer = QMessageBox.question(self, "Cannot Recover Edits", f"{error}\n\nThe edits before it were recovered. "
+                                              "Discard all unsaved edits and open the CSV file as it was last saved?")
+                if answer == QMessageBox.Yes:
+                    self.journal.discard()
+                    self.load_csv(self.current_csv)
+                    return
+            self.set_store(self.store) # Every step may have changed
+
+        self.report_problems(self.store.check())
         self.update_cell_list()
         self.draw_cell_ids()
 
+    # This function reports a csv file the loader could not read and leaves the images without cell data
+    def loading_failed(self, reason):
+        if self.loader is None or self.sender() is not self.loader:
+            return
+        self.close_loader()
+        self.clear_csv()
+        QMessageBox.warning(self, "Cannot Open CSV", reason)
+
+    # This function stops a load that is still running, the cells loaded so far are dropped
+    def cancel_loading(self):
+        if self.loader is None:
+            return
+        self.loader.requestInterruption()
+        self.loader.wait()
+        self.close_loader()
+        self.clear_csv()
+
+    # This function forgets the loader and closes its progress dialog
+    def close_loader(self):
+        self.loader = None
+        if self.load_progress is not None:
+            self.load_progress.canceled.disconnect(self.cancel_loading)
+            self.load_progress.close()
+            self.load_progress = None
+
+    # This function makes store the current LineageStore and drops everything drawn from the previous one
+    def set_store(self, store):
+        self.store = store
+        self.step_map = store.step_map if store is not None else None
+        self.label_cache = {}
+        self.overlay_cache.clear()
+        self.grid_cache = {}
+
+    # This function forgets the current csv file and shows the image without cell IDs
+    def clear_csv(self):
+        self.current_csv = None
+        self.set_store(None)
+        self.Choose_Cell.clear()
+        if self.file_list is not None:
+            self.Image_Container.setPixmap(self.scaled_frame())
+
+    # This function tells whether the csv file is fully loaded, and warns that edits have to wait if it is not
+    def csv_loaded(self):
+        if self.loader is not None:
+            QMessageBox.information(self, "Still Loading", "Please wait until the CSV file is loaded.")
+            return False
+        return self.store is not None
+
     # This function updates the chosen_cell variable to the current selection in the Choose_Cell combobox
     def update_chosen_cell(self):
         # Get the current selection in the combobox
@@ -166,6 +351,15 @@ class CellLineageCorrection(QMainWindow):
             self.Cell_ID.clear()
             self.Cell_Parent.clear()
 
+    # This function pins the cell whose lineage is isolated to the cell the user picked
+    # Unlike chosen_cell it stays the same when the images are changed, so the lineage can be followed after the cell divides
+    def update_lineage_root(self):
+        try:
+            self.lineage_root = int(self.Choose_Cell.currentText())
+        except ValueError:
+            self.lineage_root = None
+        self.draw_cell_ids()
+
     # This function updates the step label to the current step number
     def update_step_label(self):
         new_text = "Step #" + str(self.file_counter + 1)
@@ -173,7 +367,9 @@ class CellLineageCorrection(QMainWindow):
 
     # This function updates the Choose_Cell combobox to the current cells in the step_map
     def update_cell_list(self):
-        if self.step_map is not None:
+        if self.step_map is not None and self.file_counter + 1 not in self.step_map:
+            self.Choose_Cell.clear()  # The step is not loaded yet, or has no cells
+        elif self.step_map is not None:
             # Get the cell IDs for the current step
             cell_index = self.step_map[self.file_counter + 1]
             cell_ids = [str(cell_id) for cell_id in cell_index["cell_ids"].keys()]  # Convert each cell_id to a string
@@ -204,9 +400,9 @@ class CellLineageCorrection(QMainWindow):
             self.update_step_label()  # Update the label text
             self.update_cell_list()
             self.current_file = self.file_list[self.file_counter]
-            pixmap = QtGui.QPixmap(self.current_file)
-            self.Image_Container.setPixmap(pixmap.scaled(self.width(), self.height(), Qt.KeepAspectRatio))
+            self.Image_Container.setPixmap(self.scaled_frame())
             self.draw_cell_ids()
+            self.prefetch_neighbours()
     
     # This function is called when the user clicks the left arrow button
     def previous_image(self):
@@ -217,48 +413,147 @@ class CellLineageCorrection(QMainWindow):
             self.update_step_label()  # Update the label text
             self.update_cell_list()
             self.current_file = self.file_list[self.file_counter]
-            pixmap = QtGui.QPixmap(self.current_file)
-            self.Image_Container.setPixmap(pixmap.scaled(self.width(), self.height(), Qt.KeepAspectRatio))
+            self.Image_Container.setPixmap(self.scaled_frame())
             self.draw_cell_ids()
-
-    # This function draws the cell IDs on the image
+            self.prefetch_neighbours()
+
+    # This function queues the images around the current one for decoding in the background, nearest first
+    # Both directions are prefetched because navigation wraps around at either end of the file_list
+    def prefetch_neighbours(self):
+        paths = []
+        for distance in range(1, self.prefetch_count + 1):
+            for direction in (1, -1):
+                path = self.file_list[(self.file_counter + direction * distance) % len(self.file_list)]
+                if path not in paths and path != self.current_file:
+                    paths.append(path)
+        self.frame_cache.prefetch(paths)
+
+    # This function returns the pixel position of a cell in the step_map
+    def cell_pixel(self, cell_data):
+        if cell_data.get("added"):
+            # Cells added by clicking on the image have no row in the csv file, so their position is parsed from the entry
+            return tuple(to_pixels(parse_vector_column(pd.Series([cell_data["pos"]]), 2)[0], self.um_per_pixel).tolist())
+        return tuple(self.store.cell_values("pos_px", cell_data["index"]).tolist())
+
+    # This function returns an (N, 2) array of where to draw the cell ID labels of a step and an array of the cell IDs
+    # The positions are the top left corners of the labels on the full resolution image
+    # They are computed once per step and reused for every redraw until an edit clears label_cache
+    def step_labels(self, step):
+        if step not in self.label_cache:
+            cells = self.step_map[step]["cell_ids"]
+            rows = np.fromiter((cell_data["index"] for cell_data in cells.values()), dtype=np.intp, count=len(cells))
+            points = self.store.cell_values("pos_px", rows)
+            for i, cell_data in enumerate(cells.values()):
+                if cell_data.get("added"):
+                    points[i] = self.cell_pixel(cell_data)
+            points[:, 1] -= QFontMetrics(self.label_font).ascent()  # The cell position is where drawText put the baseline, the atlas places the top
+            self.label_cache[step] = (points, np.fromiter(cells, dtype=np.int64, count=len(cells)))
+        return self.label_cache[step]
+
+    # This function returns the current image scaled to the window, scaling it only when the image or the window changed
+    # It is scaled from the nearest level of the image's pyramid, see FrameCache.scaled_pixmap
+    def scaled_frame(self):
+        key, size, pixmap = self.scaled_frame_cache
+        if key != self.current_file or size != (self.width(), self.height()):
+            pixmap = self.frame_cache.scaled_pixmap(self.current_file, self.width(), self.height())
+            self.scaled_frame_cache = (self.current_file, (self.width(), self.height()), pixmap)
+        return pixmap
+
+    # This function returns the layer with every cell ID label of a step at the size the image is shown
+    # Layers are kept for the last max_overlays steps shown, an edit drops only the layers of the steps it changed
+    def step_overlay(self, step, frame):
+        if self.overlay_size != frame.size():
+            self.overlay_cache.clear()
+            self.overlay_size = frame.size()
+        layer = self.overlay_cache.get(step)
+        if layer is None:
+            points, ids = self.step_labels(step)
+            layer = self.glyph_atlas.layer(frame.size(), ids, points, self.frame_scale(frame))
+            self.overlay_cache[step] = layer
+            while len(self.overlay_cache) > self.max_overlays:
+                self.overlay_cache.popitem(last=False)
+        self.overlay_cache.move_to_end(step)
+        return layer
+
+    # This function returns how much smaller or larger than the full resolution image the shown image is
+    def frame_scale(self, frame):
+        return frame.width() / max(self.frame_cache.size(self.current_file).width(), 1)
+
+    # This function draws the cell IDs over the image
+    # All labels come from the step's cached layer, isolated cells are few enough to be drawn straight from the glyph atlas
+    @timed("draw_cell_ids")
     def draw_cell_ids(self):
-        if self.file_counter is not None and self.step_map:
-            pixmap = QtGui.QPixmap(self.current_file)
+        if self.file_counter is not None and self.step_map is not None and self.file_counter + 1 not in self.step_map:
+            self.Image_Container.setPixmap(self.scaled_frame())  # The step is not loaded yet, or has no cells
+        elif self.file_counter is not None and self.step_map:
+            step = self.file_counter + 1
+            frame = self.scaled_frame()
+            pixmap = QtGui.QPixmap(frame) # Qt copies the pixels once the painter starts, so the scaled image stays clean
             painter = QPainter(pixmap)
-            painter.setPen(QColor(255, 255, 255))  # Set the color of the pen to white
-            painter.setFont(QFont('Arial', 5))  # Set the font size
 
-            # If the IsolateCell checkbox is checked, draw only the chosen cell
-            if self.IsolateCell.isChecked() and self.chosen_cell:
+            # If the IsolateCell and IsolateDescendants checkboxes are checked, draw the pinned cell and its descendants in this step
+            if self.IsolateCell.isChecked() and self.IsolateDescendants.isChecked():
+                if self.lineage_root is not None and self.loader is None:  # The lineage is known once the file is loaded
+                    points, ids = self.step_labels(step)
+                    shown = np.isin(ids, np.append(self.store.lineage.descendants(self.lineage_root), self.lineage_root))
+                    self.glyph_atlas.draw(painter, ids[shown], points[shown], self.frame_scale(frame))
+            # If only the IsolateCell checkbox is checked, draw only the chosen cell
+            elif self.IsolateCell.isChecked() and self.chosen_cell:
                 try:
-                    chosen_cell_as_int = int(self.chosen_cell)
-                    if chosen_cell_as_int in self.step_map[self.file_counter + 1]["cell_ids"]:
-                        cell_data = self.step_map[self.file_counter + 1]["cell_ids"][chosen_cell_as_int]
-                        pos = cell_data["pos"].strip('[]').split(', ')
-                        x = int(round(float(pos[0]) / self.um_per_pixel))
-                        y = int(round(float(pos[1]) / self.um_per_pixel))
-                        painter.drawText(x, y, str(chosen_cell_as_int))
+                    points, ids = self.step_labels(step)
+                    shown = ids == int(self.chosen_cell)
+                    self.glyph_atlas.draw(painter, ids[shown], points[shown], self.frame_scale(frame))
                 except ValueError:
                     # Handle the case where chosen_cell is not an integer
                     pass
             else:
                 # If the checkbox is not checked, draw all cell IDs
-                for cell_id, cell_data in self.step_map[self.file_counter + 1]["cell_ids"].items():
-                    pos = cell_data["pos"].strip('[]').split(', ')
-                    x = int(round(float(pos[0]) / self.um_per_pixel))
-                    y = int(round(float(pos[1]) / self.um_per_pixel))
-                    painter.drawText(x, y, str(cell_id))
+                painter.drawPixmap(0, 0, self.step_overlay(step, frame))
 
             painter.end()
-            self.Image_Container.setPixmap(pixmap.scaled(self.width(), self.height(), Qt.KeepAspectRatio))
+            self.Image_Container.setPixmap(pixmap)
 
-    # This function is called when the image is clicked, uninportant for now
+    # This function returns the CellGrid of a step, built on the first click on that step and reused until an edit clears it
+    def step_grid(self, step):
+        if step not in self.grid_cache:
+            cells = self.step_map[step]["cell_ids"]
+            rows = np.fromiter((cell_data["index"] for cell_data in cells.values()), dtype=np.intp, count=len(cells))
+            ends = self.store.cell_values("ends", rows)
+            for i, cell_data in enumerate(cells.values()):
+                if cell_data.get("added"):
+                    # Cells added by clicking have only a position, so they are a segment of length zero
+                    ends[i] = parse_vector_column(pd.Series([cell_data["pos"]]), 2)[0]
+            self.grid_cache[step] = CellGrid(np.fromiter(cells, dtype=np.int64, count=len(cells)), ends)
+        return self.grid_cache[step]
+
+    # This function converts a click on the Image_Container to a position on the unscaled image, in pixels
+    # The image is shown scaled to fit and aligned to the left and vertically centered, as QLabel does by default
+    def image_position(self, pos):
+        shown = self.Image_Container.pixmap()
+        if shown is None or shown.isNull():
+            return pos
+        size = self.frame_cache.size(self.current_file)
+        area = self.Image_Container.contentsRect()
+        scale = size.width() / shown.width()
+        x = (pos.x() - area.x()) * scale
+        y = (pos.y() - area.y() - (area.height() - shown.height()) // 2) * scale
+        return QPoint(int(x), int(y))
+
+    # This function is called when the image is clicked
+    # Clicking on a cell selects it, clicking anywhere else adds a new cell there
+    # Cells are found from their ends, so when the csv file has no ends column every click adds a cell
     def image_clicked(self, pos):
-        self.collect_cell_info(pos)
+        pos = self.image_position(pos)
         position = [pos.x() * self.um_per_pixel, pos.y() * self.um_per_pixel]
-        position = str(position)
-        print(position)
+        if self.file_counter is not None and self.step_map and self.file_counter + 1 in self.step_map and self.store.has_column("ends"):
+            found = self.step_grid(self.file_counter + 1).nearest(position, self.click_tolerance)
+            if found is not None:
+                self.Choose_Cell.setCurrentText(str(found[0]))
+                self.update_lineage_root()
+                return
+        print(str(position))
+        if self.step_map is None or self.csv_loaded():
+            self.collect_cell_info(pos)
 
     # This function is called when the user clicks on the image to add a cell
     def collect_cell_info(self, pos):
@@ -267,8 +562,27 @@ class CellLineageCorrection(QMainWindow):
             parent_id, okPressed_parent = QInputDialog.getText(self, "Parent ID","Enter Parent ID (default 0):", QLineEdit.Normal, "0")
             if not okPressed_parent:  # If the user cancels the parent_id dialog, we set it to 0 by default
                 parent_id = "0"
+            cell_id = self.read_id(cell_id, "Cell")
+            parent_id = None if cell_id is None else self.read_id(parent_id, "Parent")
+            if parent_id is None:
+                return
             # Save the data
-            self.save_cell_info(int(cell_id), int(parent_id), pos)
+            self.save_cell_info(cell_id, parent_id, pos)
+
+    # This function converts a cell or parent id the user typed to an int
+    # It warns and returns None if the text is not a number or the id does not fit the tracking data, see check_id
+    def read_id(self, text, kind):
+        try:
+            value = int(text)
+        except ValueError:
+            QMessageBox.warning(self, f"Invalid {kind} ID", f"Please enter a valid {kind.lower()} ID.")
+            return None
+        try:
+            check_id(value, kind)
+        except ValueError as error:
+            QMessageBox.warning(self, f"Invalid {kind} ID", str(error))
+            return None
+        return value
 
     # This function saves the cell information to the step_map and csv_data, also unimportant for now
     def save_cell_info(self, cell_id, parent_id, pos):
@@ -281,11 +595,17 @@ class CellLineageCorrection(QMainWindow):
         # if step_num not in self.step_map:
         #     self.step_map[step_num] = {"index": len(self.step_map) + 1, "cell_ids": {}}
         
-        self.step_map[step_num]["cell_ids"][cell_id] = {
-            "index": len(self.step_map[step_num]["cell_ids"]) + 1, # This is problematic for csv insertion. We need to find a way to keep track of the index for all of the cells that proceed this one. Currently unused so lets keep it as is.
-            "parent_id": str(parent_id),
-            "pos": position
+        # The cell is added as an edit operation, so it is journaled and can be undone like the other edits
+        operation = {
+            "op": "add",
+            "step": step_num,
+            "cell": cell_id,
+            "parent": parent_id,
+            "pos": position, # The cell has no row in the csv file, so it is shown and journaled but not saved, see apply_operation
         }
+        changes = []
+        changed_steps = self.store.apply(operation, changes)
+        self.journal.record(operation, changes)
 
         # Update csv_data - create a new row with the new cell information
         # new_row = {
@@ -298,13 +618,18 @@ class CellLineageCorrection(QMainWindow):
 
         # Redraw the image with the new cell
         print(self.step_map[step_num])
-        self.draw_cell_ids()
+        self.refresh_after_edit(changed_steps)
+        self.snapshot_if_due()
 
         #save the new csv_data to file
         # self.csv_data.to_csv(self.current_csv, index=False)
 
     # This function is called when the user clicks the Change Cell Info button
+    @timed("change_cell_info")
     def change_cell_info(self):
+        if not self.csv_loaded():
+            return
+
         # Check if a cell is selected
         if not self.chosen_cell:
             QMessageBox.warning(self, "No Cell Selected", "Please select a cell to change.")
@@ -314,86 +639,158 @@ class CellLineageCorrection(QMainWindow):
         new_parent_id = self.Cell_Parent.text()
         
         # Convert inputs to proper types
-        try:
-            new_cell_id = int(new_cell_id)
-        except ValueError:
-            QMessageBox.warning(self, "Invalid Cell ID", "Please enter a valid cell ID.")
+        # The ids have to fit the id and parent_id columns, or writing the edit into the tracking data would fail after it was journaled
+        new_cell_id = self.read_id(new_cell_id, "Cell")
+        if new_cell_id is None:
             return
 
-        try:
-            new_parent_id = int(new_parent_id)
-        except ValueError:
-            QMessageBox.warning(self, "Invalid Parent ID", "Please enter a valid parent ID.")
+        new_parent_id = self.read_id(new_parent_id, "Parent")
+        if new_parent_id is None:
             return
         
         current_step = self.file_counter + 1
         old_cell_id = int(self.chosen_cell)
 
+        changed_steps = set()
+        changes = [] # Everything the edit changes, so it can be undone
+
         # Update step_map 
         if new_cell_id != old_cell_id:
             print("cell_id changed")
-            for step, step_data in self.step_map.items():
-                # Edits only current step and future steps
-                if step < current_step:
-                    continue
-                cell_ids = list(step_data["cell_ids"].keys())  # Create a list of keys to iterate over
-                for cell_id in cell_ids:
-                    if cell_id == old_cell_id:
-                        # Change all cell_IDs that are equal to the incorrect cell you are correcting, changes to the new_cell_id
-                        step_data["cell_ids"][new_cell_id] = step_data["cell_ids"].pop(old_cell_id)
-
-                    elif step_data["cell_ids"][cell_id]["parent_id"] == old_cell_id:
-                        # Because you change the old_cell_id to the new_cell_id, you need to change the parent for all of its children
-                        step_data["cell_ids"][cell_id]["parent_id"] = new_cell_id
-                        
+            # Change the cell in the current step and future steps to the new_cell_id, and the parent of all of its children
+            changed_steps |= self.store.relabel(current_step, old_cell_id, new_cell_id, changes)
+
         if new_parent_id != self.step_map[current_step]["cell_ids"][new_cell_id]["parent_id"]:
             print("parent_id changed")
-            # Change the parent ID for all cells with the same cell ID
-            for step, step_data in self.step_map.items():
-                # Edits only current step and future steps
-                if step < current_step:
-                    continue
-                cell_ids = list(step_data["cell_ids"].keys())
-                for cell_id in cell_ids:
-                    if cell_id == new_cell_id:
-                        step_data["cell_ids"][cell_id]["parent_id"] = new_parent_id
+            # Change the parent ID for all cells with the same cell ID in the current step and future steps
+            changed_steps |= self.store.reparent(current_step, new_cell_id, new_parent_id, changes)
+
+        # Journal the edit the same way the button made it, so replaying it runs the same checks
+        if changes:
+            self.journal.record({"op": "change", "step": current_step, "old": old_cell_id, "new": new_cell_id, "parent": new_parent_id}, changes)
+
+        self.refresh_after_edit(changed_steps)
+        if changes:
+            self.snapshot_if_due()
+        self.Choose_Cell.setCurrentIndex(self.Choose_Cell.findText(str(new_cell_id)))
+        # self.update_chosen_cell()
+
+    # This function is called from the Edit menu to undo the last edit
+    def undo_edit(self):
+        if self.journal is None:
+            return
+        changed_steps = self.journal.undo(self.store)
+        if changed_steps is None:
+            print("Nothing to undo")
+            return
+        self.refresh_after_edit(changed_steps)
+        self.snapshot_if_due()
+
+    # This function is called from the Edit menu to redo the last undone edit
+    def redo_edit(self):
+        if self.journal is None:
+            return
+        changed_steps = self.journal.redo(self.store)
+        if changed_steps is None:
+            print("Nothing to redo")
+            return
+        self.refresh_after_edit(changed_steps)
+        self.snapshot_if_due()
+
+    # This function writes a snapshot of the edited ids in the background every so many edits, so crash recovery stays quick
+    def snapshot_if_due(self):
+        if self.journal.snapshot_due():
+            self.journal.write_snapshot(self.store)
+
+    # This function checks the lineage and updates the image and the cell list after the step_map changed
+    # The check has to run before anything flushes the edit into the tracking data, see LineageStore.check
+    def refresh_after_edit(self, changed_steps):
+        self.report_problems(self.store.check(changed_steps))
+
+        # The labels and grids of the changed steps are rebuilt when they are next needed
+        for step in changed_steps:
+            self.label_cache.pop(step, None)
+            self.overlay_cache.pop(step, None)
+            self.grid_cache.pop(step, None)
 
         # Redraw the image with updated cell IDs
         self.draw_cell_ids()
 
         # Update the UI components to reflect the changes
         self.update_cell_list()
-        self.Choose_Cell.setCurrentIndex(self.Choose_Cell.findText(str(new_cell_id)))
-        # self.update_chosen_cell()
+
+    # This function shows how many lineage problems the last check found in the status bar and prints them
+    def report_problems(self, problems):
+        for problem in problems:
+            print(f"step {problem['step']}, cell {problem['id']}: {problem['problem']}")
+        total = sum(len(step_problems) for step_problems in self.store.problems.values())
+        if problems:
+            first = problems[0]
+            self.statusbar.showMessage(f"{total} lineage problems, e.g. step {first['step']}, cell {first['id']}: {first['problem']}")
+        elif total:
+            self.statusbar.showMessage(f"{total} lineage problems in other steps")
+        else:
+            self.statusbar.clearMessage()
 
     # This function is called when the IsolateCell checkbox is checked or unchecked
     def redraw_image(self):
         self.draw_cell_ids()
 
+    # This function is called from the File menu to write the step_map as JSON, in the layout of step_map.json
+    def export_step_map(self):
+        if not self.csv_loaded():
+            return
+        options = QFileDialog.Options()
+        fileName, _ = QFileDialog.getSaveFileName(self, "Export Step Map", "", "JSON Files (*.json)", options=options)
+        if fileName:
+            export_step_map(self.store, fileName)
+
     # This function is called when the user clicks the Save button
     def save_csv(self):
-        if self.step_map is None or self.csv_data is None:
+        if self.loader is not None:
+            self.csv_loaded()  # Warns that saving has to wait
+            return
+        if self.store is None:
             QMessageBox.warning(self, "No Data", "There is no data to save.")
             return
 
-        # Iterate through each step in step_map and update csv_data
-        for step_num, step_info in self.step_map.items():
-            for cell_id, cell_info in step_info['cell_ids'].items():
-                index = cell_info['index']  # Get the index of the row in the csv_data
-                # Update the csv_data DataFrame at the specified index
-                self.csv_data.iloc[index, self.csv_data.columns.get_loc("id")] = cell_id
-                self.csv_data.iloc[index, self.csv_data.columns.get_loc("parent_id")] = cell_info['parent_id']
-
-        # print("csv_data: ", self.csv_data, sep="\n")
         # Use a file dialog to get the location and name of the file to save
+        # Parquet and Feather files hold the same columns as the csv file and are much faster to write for large lineages
         options = QFileDialog.Options()
-        fileName, _ = QFileDialog.getSaveFileName(self, "Save CSV", "", "CSV Files (*.csv)", options=options)
+        fileName, fileFilter = QFileDialog.getSaveFileName(self, "Save CSV", "", "CSV Files (*.csv);;Parquet Files (*.parquet);;Feather Files (*.feather)", options=options)
         if fileName:
-            # Save the updated DataFrame to a new CSV file
-            self.csv_data.to_csv(fileName, index=False)
+            if not os.path.splitext(fileName)[1]:
+                fileName += ".parquet" if "parquet" in fileFilter else ".feather" if "feather" in fileFilter else ".csv"
+            try:
+                self.store.save(fileName) # Only the edited cells are written back into the data before it is saved
+            except ImportError as error:
+                QMessageBox.warning(self, "Save Failed", f"Saving this format needs pyarrow (pip install pyarrow): {error}")
+                return
+            except (OSError, ValueError) as error:
+                QMessageBox.warning(self, "Save Failed", f"Could not save {fileName}: {error}")
+                return
+            # Once the opened CSV file itself holds the edits, the journal of edits to its old contents is no longer needed
+            if os.path.abspath(fileName) == os.path.abspath(self.current_csv):
+                self.journal.discard()
             QMessageBox.information(self, "Save Successful", f"File saved to {fileName}")
 
 
+    # This function is called when the window is closed
+    def closeEvent(self, event):
+        stats = self.frame_cache.stats()
+        print(f"Image cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), "
+              f"{stats['prefetched']} prefetched, {stats['frames']} frames using {stats['bytes'] / 2**20:.1f} of {stats['max_bytes'] / 2**20:.0f} MB")
+        self.frame_cache.close()
+        if self.frame_source is not None:
+            self.frame_source.close()
+        self.cancel_loading()
+        if self.cache_writer is not None:
+            self.cache_writer.join()
+        if self.journal is not None:
+            self.journal.close()
+        super().closeEvent(event)
+
+
 # This is the main function that runs the program
 def main():
     app = QApplication([])
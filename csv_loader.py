@@ -0,0 +1,37 @@
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from lineage_store import VIEWER_COLUMNS, CHUNK_ROWS, iter_step_chunks, prepare_chunk
+
+# This reads a tracking csv file on a worker thread so the window stays responsive while a large file loads
+# Each chunk is parsed and indexed on the worker and handed to the GUI thread with chunk_loaded, which adds it to a LineageStore
+# The steps of a chunk can be shown as soon as it arrives, the store is complete once loaded is emitted
+
+
+class CsvLoader(QThread):
+    chunk_loaded = pyqtSignal(object) # (chunk, table, step_map) as returned by prepare_chunk
+    progress = pyqtSignal(int) # Percentage of the file read so far
+    loaded = pyqtSignal() # Every chunk was sent
+    failed = pyqtSignal(str) # The file could not be read, with the reason
+
+    def __init__(self, path, um_per_pixel, columns=VIEWER_COLUMNS, chunk_rows=CHUNK_ROWS, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.um_per_pixel = um_per_pixel
+        self.columns = columns
+        self.chunk_rows = chunk_rows
+
+    # This is the body of the worker thread, call requestInterruption to cancel it between two chunks
+    def run(self):
+        start = 0
+        try:
+            for chunk, fraction in iter_step_chunks(self.path, self.columns, self.chunk_rows):
+                if self.isInterruptionRequested():
+                    return
+                self.chunk_loaded.emit(prepare_chunk(chunk, start, self.um_per_pixel))
+                self.progress.emit(int(fraction * 100))
+                start += len(chunk)
+        except (OSError, ValueError, KeyError) as error:
+            self.failed.emit(str(error))
+            return
+        if not self.isInterruptionRequested():
+            self.loaded.emit()
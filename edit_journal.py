@@ -0,0 +1,228 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+from lineage_store import csv_signature
+
+# The edit journal keeps unsaved corrections safe without rewriting the csv file after every edit
+# Every edit operation is appended as one JSON line to <csv>.journal as soon as it is made, together with undo and redo records
+# Every snapshot_every edits the id and parent_id columns are written to <csv>.snapshot.npz on a background thread,
+# with the rows a rename left out of the step_map, so recovering after a crash only has to replay the edits made since the last snapshot
+# The journal belongs to one version of the csv file, its first line holds the csv_signature of the file
+
+
+class EditJournal:
+
+    def __init__(self, csv_path, snapshot_every=500):
+        self.csv_path = csv_path
+        self.path = csv_path + ".journal"
+        self.snapshot_path = csv_path + ".snapshot.npz"
+        self.snapshot_every = snapshot_every
+        self.undo_stack = [] # (operation, changes) of the edits that can be undone, newest last
+        self.redo_stack = [] # (operation, changes) of the undone edits that can be redone, newest last
+
+        self._records = 0 # Number of records in the journal file, not counting the header
+        self._since_snapshot = 0
+        self._file = None
+        self._snapshot_thread = None
+
+    # This function returns the records of a journal a previous session left behind for this csv file
+    # It returns None when there is no journal or it belongs to a different version of the csv file
+    def unsaved_records(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as file:
+            lines = file.read().splitlines()
+        try:
+            if json.loads(lines[0]) != csv_signature(self.csv_path):
+                return None
+        except (IndexError, ValueError):
+            return None
+
+        records = []
+        for line in lines[1:]:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break  # The session crashed while writing this line, everything before it is intact
+        return records or None
+
+    # This function prepares recovering the records of unsaved_records into a LineageStore loaded from the csv file
+    # If a snapshot covers the start of the records, the store is rebuilt from it and only the rest is returned
+    # The store must then be handed to replay with the returned records
+    def recover(self, store, records):
+        snapshot = self._read_snapshot()
+        if snapshot is not None and "detached" in snapshot:
+            covered = int(snapshot["records"])
+            # Added cells are only in the step_map, so a snapshot cannot stand in for the records that added them
+            added = any(record["op"] == "add" for record in records[:covered])
+            if covered <= len(records) and len(snapshot["id"]) == len(store.data) and not added and self._self_contained(records[covered:]):
+                store.data["id"] = snapshot["id"]
+                store.data["parent_id"] = snapshot["parent_id"]
+                store.reindex(snapshot["detached"])
+                self._rewrite(records)
+                self._since_snapshot = len(records) - covered
+                return records[covered:]
+        self._rewrite(records)
+        return records
+
+    # This function applies recovered records to a LineageStore, rebuilding the undo and redo history as it goes
+    # It raises a ValueError if a record cannot be applied, the records before it stay applied and journaled, the rest are dropped
+    def replay(self, records, store):
+        for number, record in enumerate(records):
+            try:
+                self._replay_record(record, store)
+            except ValueError as error:
+                dropped = len(records) - number
+                self._rewrite(self.unsaved_records()[:self._records - dropped])
+                self._since_snapshot = max(self._since_snapshot - dropped, 0)
+                raise ValueError(f"Edit {number + 1} of {len(records)} cannot be recovered: {error}") from error
+
+    # This function applies one recovered record to a LineageStore
+    def _replay_record(self, record, store):
+        if record["op"] == "undo":
+            if not self.undo_stack:
+                raise ValueError("there is no edit to undo")
+            operation, changes = self.undo_stack.pop()
+            store.undo(changes)
+            self.redo_stack.append((operation, changes))
+        elif record["op"] == "redo":
+            if not self.redo_stack:
+                raise ValueError("there is no edit to redo")
+            operation, changes = self.redo_stack.pop()
+            store.redo(changes)
+            self.undo_stack.append((operation, changes))
+        else:
+            changes = []
+            store.apply(record, changes)
+            self.undo_stack.append((record, changes))
+            self.redo_stack.clear()
+
+    # This function journals an edit that was just applied to the LineageStore and the changes it made
+    def record(self, operation, changes):
+        self._write(operation)
+        self.undo_stack.append((operation, changes))
+        self.redo_stack.clear()
+        self._since_snapshot += 1
+
+    # This function undoes the newest edit and returns the steps that were changed, or None if there is nothing to undo
+    def undo(self, store):
+        if not self.undo_stack:
+            return None
+        operation, changes = self.undo_stack.pop()
+        changed = store.undo(changes)
+        self.redo_stack.append((operation, changes))
+        self._write({"op": "undo"})
+        self._since_snapshot += 1
+        return changed
+
+    # This function redoes the newest undone edit and returns the steps that were changed, or None if there is nothing to redo
+    def redo(self, store):
+        if not self.redo_stack:
+            return None
+        operation, changes = self.redo_stack.pop()
+        changed = store.redo(changes)
+        self.undo_stack.append((operation, changes))
+        self._write({"op": "redo"})
+        self._since_snapshot += 1
+        return changed
+
+    # This function tells whether enough edits were made since the last snapshot to write a new one
+    def snapshot_due(self):
+        running = self._snapshot_thread is not None and self._snapshot_thread.is_alive()
+        return self._since_snapshot >= self.snapshot_every and not running
+
+    # This function writes the id and parent_id columns of a LineageStore and its detached rows in the background
+    # The store must hold every edit in the journal, it is flushed and only the arrays are copied before the thread starts
+    def write_snapshot(self, store):
+        store.flush()
+        arrays = {
+            "id": store.data["id"].to_numpy(copy=True),
+            "parent_id": store.data["parent_id"].to_numpy(copy=True),
+            "detached": store.detached_rows(),
+            "records": np.int64(self._records),
+        }
+        self._since_snapshot = 0
+        self._snapshot_thread = threading.Thread(target=self._save_snapshot, args=(arrays,), name="EditJournalSnapshot", daemon=True)
+        self._snapshot_thread.start()
+
+    # This function deletes the journal and snapshot, once the edits are saved or the user chose not to recover them
+    # The undo and redo history is dropped with them, since it could no longer be replayed after a crash
+    def discard(self):
+        self.close()
+        for path in (self.path, self.snapshot_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self._records = 0
+        self._since_snapshot = 0
+
+    # This function closes the journal file and waits for a snapshot that is still being written
+    def close(self):
+        if self._snapshot_thread is not None:
+            self._snapshot_thread.join()
+            self._snapshot_thread = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # This function appends one record and makes sure it reaches the disk before the edit is shown
+    def _write(self, record):
+        if self._file is None:
+            self._file = open(self.path, "w")
+            self._file.write(json.dumps(csv_signature(self.csv_path)) + "\n")
+        self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._records += 1
+
+    # This function starts the journal file over with the recovered records, dropping a line cut off by a crash
+    def _rewrite(self, records):
+        self.close()
+        with open(self.path, "w") as file:
+            file.write(json.dumps(csv_signature(self.csv_path)) + "\n")
+            for record in records:
+                file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._file = open(self.path, "a")
+        self._records = len(records)
+
+    # This is the body of the snapshot thread, the snapshot replaces the previous one only once it is complete
+    def _save_snapshot(self, arrays):
+        temporary = self.snapshot_path + ".tmp.npz"
+        np.savez(temporary, **arrays)
+        os.replace(temporary, self.snapshot_path)
+
+    # This function loads the snapshot, or returns None if there is none
+    def _read_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return None
+        try:
+            with np.load(self.snapshot_path) as snapshot:
+                return {key: snapshot[key] for key in snapshot.files}
+        except (OSError, ValueError):
+            return None
+
+    # This function tells whether records can be replayed without the edits before them
+    # They cannot if they undo or redo an edit that was made before the first record
+    @staticmethod
+    def _self_contained(records):
+        undoable = 0
+        redoable = 0
+        for record in records:
+            if record["op"] == "undo":
+                if undoable == 0:
+                    return False
+                undoable -= 1
+                redoable += 1
+            elif record["op"] == "redo":
+                if redoable == 0:
+                    return False
+                redoable -= 1
+                undoable += 1
+            else:
+                undoable += 1
+                redoable = 0
+        return True
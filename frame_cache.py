@@ -0,0 +1,195 @@
+import threading
+from collections import OrderedDict
+
+from PyQt5 import QtGui
+from PyQt5.QtCore import Qt
+
+from perf import timed
+
+# This is a least recently used cache of decoded images, keyed by file path or frame key
+# Decoding happens either on demand or ahead of time in a background thread that prefetches neighbouring frames
+# QImage can be decoded on any thread, but QPixmap must stay on the GUI thread, so the worker only ever touches QImages
+# Every frame also gets a pyramid, copies of it at half, a quarter, ... of its size, so showing it small never scales the full resolution image
+
+PYRAMID_MIN_SIZE = 256 # Frames are halved while the long side of the result stays at least this many pixels
+
+
+class FrameCache:
+
+    # max_bytes caps the memory used by decoded frames, the oldest frames are dropped first once it is exceeded
+    # loader decodes a key into a QImage, it is a FrameSource's load function once a directory or stack is open
+    def __init__(self, max_bytes=512 * 1024 * 1024, loader=QtGui.QImage):
+        self.max_bytes = max_bytes
+        self.loader = loader
+        self.hits = 0 # Number of requests served from the cache
+        self.misses = 0 # Number of requests that had to decode the file
+        self.prefetched = 0 # Number of frames decoded by the background thread
+
+        self._images = OrderedDict() # Path -> QImage, in least to most recently used order
+        self._pixmaps = {} # Path -> QPixmap, only read and written on the GUI thread
+        self._pyramids = {} # Path -> list of QImages at half, a quarter, ... of the size of the frame
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._pending = [] # Paths the worker should decode next
+        self._wakeup = threading.Condition(self._lock)
+        self._closed = False
+        self._worker = threading.Thread(target=self._prefetch_loop, name="FrameCachePrefetch", daemon=True)
+        self._worker.start()
+
+    # This function returns the decoded image for a path, decoding it now if it is not cached
+    def image(self, path):
+        with self._lock:
+            image = self._images.get(path)
+            if image is not None:
+                self._images.move_to_end(path)
+                self.hits += 1
+                return image
+            self.misses += 1
+
+        image = self.loader(path)
+        with self._lock:
+            self._insert(path, image)
+        return image
+
+    # This function returns the size of the image for a path without counting it as a request, it is decoded only if it is not cached
+    def size(self, path):
+        with self._lock:
+            image = self._images.get(path)
+        if image is None:
+            image = self.image(path)
+        return image.size()
+
+    # This function returns the image for a path as a QPixmap, it must only be called from the GUI thread
+    def pixmap(self, path):
+        image = self.image(path)
+        pixmap = self._pixmaps.get(path)
+        if pixmap is None:
+            # Pixmaps of frames the worker evicted are dropped here rather than on the worker thread
+            with self._lock:
+                for stale in [key for key in self._pixmaps if key not in self._images]:
+                    del self._pixmaps[stale]
+            pixmap = QtGui.QPixmap.fromImage(image)
+            self._pixmaps[path] = pixmap
+        return pixmap
+
+    # This function returns the images of a frame from the full resolution one down to the smallest pyramid level
+    def pyramid(self, path):
+        image = self.image(path)
+        with self._lock:
+            levels = self._pyramids.get(path)
+        if levels is None:
+            levels = build_pyramid(image)
+            with self._lock:
+                if path in self._images and path not in self._pyramids:
+                    self._add_pyramid(path, levels)
+        return [image] + levels
+
+    # This function returns the image for a path scaled to fit in width x height as a QPixmap, it must only be called from the GUI thread
+    # The image is scaled from the smallest pyramid level that is still at least as large as the result
+    @timed("scale_frame")
+    def scaled_pixmap(self, path, width, height):
+        levels = self.pyramid(path)
+        size = levels[0].size().scaled(width, height, Qt.KeepAspectRatio)
+        source = levels[0]
+        for level in levels[1:]:
+            if level.width() < size.width() or level.height() < size.height():
+                break
+            source = level
+        return QtGui.QPixmap.fromImage(source.scaled(size, Qt.IgnoreAspectRatio, Qt.SmoothTransformation))
+
+    # This function replaces the queue of paths to decode in the background, the first path is decoded first
+    def prefetch(self, paths):
+        with self._lock:
+            self._pending = [path for path in paths if path not in self._images]
+            self._wakeup.notify()
+
+    # This function empties the cache, for example when a different directory is opened
+    # Passing a loader switches how keys are decoded from now on
+    def clear(self, loader=None):
+        with self._lock:
+            if loader is not None:
+                self.loader = loader
+            self._images.clear()
+            self._pyramids.clear()
+            self._pending = []
+            self._bytes = 0
+        self._pixmaps.clear()
+
+    # This function returns the counters used to size the cache
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "prefetched": self.prefetched,
+                "frames": len(self._images),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    # This function stops the prefetch thread
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        self._worker.join(timeout=1)
+
+    # This function adds a decoded image and evicts the least recently used ones, the lock must be held
+    def _insert(self, path, image):
+        if path in self._images:
+            self._bytes -= self._images.pop(path).sizeInBytes()
+            self._bytes -= sum(level.sizeInBytes() for level in self._pyramids.pop(path, []))
+        self._images[path] = image
+        self._bytes += image.sizeInBytes()
+        self._evict()
+
+    # This function adds the pyramid of a cached image and evicts the least recently used images, the lock must be held
+    def _add_pyramid(self, path, levels):
+        self._pyramids[path] = levels
+        self._bytes += sum(level.sizeInBytes() for level in levels)
+        self._evict()
+
+    # This function drops the least recently used images and their pyramids until the cache fits in max_bytes, the lock must be held
+    # The most recently used image is always kept, even if it is larger than max_bytes on its own
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._images) > 1:
+            evicted_path, evicted = self._images.popitem(last=False)
+            self._bytes -= evicted.sizeInBytes()
+            self._bytes -= sum(level.sizeInBytes() for level in self._pyramids.pop(evicted_path, []))
+
+    # This is the body of the prefetch thread
+    def _prefetch_loop(self):
+        while True:
+            with self._lock:
+                while not self._pending and not self._closed:
+                    self._wakeup.wait()
+                if self._closed:
+                    return
+                path = self._pending.pop(0)
+                if path in self._images:
+                    continue
+                loader = self.loader
+
+            try:
+                image = loader(path)
+            except ValueError:
+                continue # The source of the frame was closed after it was queued
+            levels = build_pyramid(image)
+            with self._lock:
+                if loader is self.loader and path not in self._images: # The cache was not switched to another source meanwhile
+                    self._insert(path, image)
+                    self._add_pyramid(path, levels)
+                    self.prefetched += 1
+
+
+# This function halves an image until its long side would drop below PYRAMID_MIN_SIZE and returns the smaller images
+# Each level is scaled from the one before it, which is much cheaper than scaling the full resolution image every time
+@timed("build_pyramid")
+def build_pyramid(image):
+    levels = []
+    while not image.isNull() and max(image.width(), image.height()) // 2 >= PYRAMID_MIN_SIZE:
+        image = image.scaled(image.width() // 2, image.height() // 2, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+        levels.append(image)
+    return levels
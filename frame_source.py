@@ -0,0 +1,149 @@
+import os
+import threading
+
+import numpy as np
+from PyQt5 import QtGui, sip
+
+from perf import timed
+
+try:
+    import tifffile
+except ImportError:  # tifffile is only needed to open multi-page TIFF stacks
+    tifffile = None
+
+# A frame source is where the images of an experiment come from, one image per step
+# Every frame has a key, a string that names it in the file_list and in the image cache
+# For a directory of images the keys are the file paths, for a stack they name the stack file and the plane
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tif", ".tiff")
+STACK_EXTENSIONS = (".tif", ".tiff", ".npy")
+
+# These are the QImage formats a plane can be shown in without converting its pixels
+PLANE_FORMATS = {
+    (np.dtype(np.uint8), 1): QtGui.QImage.Format_Grayscale8,
+    (np.dtype(np.uint16), 1): QtGui.QImage.Format_Grayscale16,
+    (np.dtype(np.uint8), 3): QtGui.QImage.Format_RGB888,
+    (np.dtype(np.uint8), 4): QtGui.QImage.Format_RGBA8888,
+}
+
+
+class FrameSource:
+
+    def __init__(self, keys):
+        self.keys = keys # This is the list of frame keys, in step order
+        self._indices = {key: i for i, key in enumerate(keys)}
+
+    def __len__(self):
+        return len(self.keys)
+
+    # This function decodes the frame for a key, keys that are not part of this source are treated as image files
+    # It is safe to call from the image cache prefetch thread
+    @timed("decode_image")
+    def load(self, key):
+        index = self._indices.get(key)
+        if index is None:
+            return QtGui.QImage(key)
+        return self.read(index)
+
+    # This function decodes the frame at an index, each kind of source implements it
+    def read(self, index):
+        raise NotImplementedError
+
+    # This function releases the files the source holds open, once another source replaced it
+    def close(self):
+        pass
+
+
+# This is a directory with one image file per step, sorted by file name so the order matches the step numbers
+class DirectoryFrameSource(FrameSource):
+
+    def __init__(self, directory):
+        names = sorted(f for f in os.listdir(directory) if f.lower().endswith(IMAGE_EXTENSIONS))
+        super().__init__([directory + "/" + f for f in names])
+
+    def read(self, index):
+        return QtGui.QImage(self.keys[index])
+
+
+# This is a single file holding every step as a plane of a (frames, height, width[, channels]) array
+# The array is memory-mapped, so opening it reads nothing and showing a step only pages in that plane
+# It raises a ValueError if the file does not hold an array of that shape, such as a single image
+class StackFrameSource(FrameSource):
+
+    def __init__(self, path, planes=None):
+        if planes is None:
+            planes = open_stack_array(path)
+        self.path = path
+        self.planes = planes
+        if planes.ndim not in (3, 4):
+            self.close()
+            raise ValueError(f"{path} holds a {planes.ndim}-dimensional array, a stack of images has 3 or 4 dimensions")
+        super().__init__([f"{path}#{i}" for i in range(len(planes))])
+
+    def read(self, index):
+        return plane_to_image(self.planes[index])
+
+    def close(self):
+        if isinstance(self.planes, TiffPages):
+            self.planes.close()
+
+
+# This function opens the pixel array of a stack file without reading it into memory
+def open_stack_array(path):
+    if path.lower().endswith(".npy"):
+        return np.load(path, mmap_mode="r")
+
+    if tifffile is None:
+        raise ImportError("Opening multi-page TIFF stacks needs tifffile, install it with: pip install tifffile")
+    try:
+        return tifffile.memmap(path, mode="r")
+    except ValueError:
+        # Compressed or scattered TIFFs cannot be memory-mapped, so their planes are decoded one page at a time instead
+        return TiffPages(path)
+
+
+# This gives a TIFF that cannot be memory-mapped the same indexing as an array, reading only the requested page
+# The GUI thread and the image cache prefetch thread share one file handle, so pages are read one at a time
+class TiffPages:
+
+    def __init__(self, path):
+        self._file = tifffile.TiffFile(path)
+        self._lock = threading.Lock()
+        self._closed = False
+        self.ndim = 1 + len(self._file.pages[0].shape) # The pages are the first dimension, like the planes of an array
+
+    def __len__(self):
+        return len(self._file.pages)
+
+    # This function reads one page, it raises a ValueError once the file was closed
+    def __getitem__(self, index):
+        with self._lock:
+            if self._closed:
+                raise ValueError("The TIFF stack was closed")
+            return self._file.pages[index].asarray()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._file.close()
+
+
+# This function wraps a plane in a QImage
+# Planes in a PLANE_FORMATS layout are shared with the QImage without copying, other planes are scaled to 8 bits first
+def plane_to_image(plane):
+    if plane.ndim == 3 and plane.shape[2] == 1:
+        plane = plane[:, :, 0]
+    channels = 1 if plane.ndim == 2 else plane.shape[2]
+    image_format = PLANE_FORMATS.get((plane.dtype, channels))
+
+    if image_format is None:
+        low, high = float(np.min(plane)), float(np.max(plane))
+        plane = ((plane - low) * (255.0 / (high - low or 1.0))).astype(np.uint8)
+        image_format = PLANE_FORMATS.get((plane.dtype, channels), QtGui.QImage.Format_Grayscale8)
+    if plane.strides[-1] != plane.itemsize or (plane.ndim == 3 and plane.strides[1] != plane.itemsize * channels):
+        plane = np.ascontiguousarray(plane)
+
+    height, width = plane.shape[:2]
+    image = QtGui.QImage(sip.voidptr(plane.ctypes.data), width, height, plane.strides[0], image_format)
+    image._plane = plane  # The QImage does not own its pixels, so the plane has to live as long as the image
+    return image
@@ -0,0 +1,112 @@
+import math
+
+import numpy as np
+from PyQt5 import sip
+from PyQt5.QtCore import Qt, QRectF
+from PyQt5.QtGui import QPainter, QPixmap, QFontMetricsF
+
+# The cell ID labels are drawn from a glyph atlas, a small pixmap holding every character an ID can contain
+# A label is one fragment of the atlas per character, and all fragments of a step are drawn with one drawPixmapFragments call,
+# so Qt does not lay out and rasterize text for every label
+# The atlas is scaled once per zoom level, so the fragments are copied without scaling, which is Qt's fast path
+# The fragments are written straight into the memory of a sip.array from numpy, each one is 10 doubles:
+# x and y of its center on the target, the left, top, width and height of its source rectangle, scaleX, scaleY, rotation and opacity
+
+CHARACTERS = "0123456789-"
+MAX_LEVELS = 4 # Number of zoom levels an atlas keeps scaled glyphs for
+
+
+class GlyphAtlas:
+
+    # The glyphs are rendered once at the font's size on the full resolution image, like drawText would draw them
+    def __init__(self, font, color, padding=1):
+        metrics = QFontMetricsF(font)
+        self.advances = np.array([metrics.horizontalAdvance(character) for character in CHARACTERS])
+        self.widths = np.ceil(self.advances) + 2 * padding # Width of each glyph's rectangle in the atlas
+        self.lefts = np.cumsum(self.widths) - self.widths # Left edge of each glyph's rectangle in the atlas
+        self.height = math.ceil(metrics.height()) + 2 * padding # Height of every glyph's rectangle in the atlas
+        self.padding = padding
+
+        # This maps the byte of a character to its glyph, characters that are not in the atlas are skipped
+        self._glyphs = np.full(256, -1, dtype=np.int64)
+        self._glyphs[np.frombuffer(CHARACTERS.encode(), dtype=np.uint8)] = np.arange(len(CHARACTERS))
+
+        self.pixmap = QPixmap(int(self.widths.sum()), self.height)
+        self.pixmap.fill(Qt.transparent)
+        painter = QPainter(self.pixmap)
+        painter.setPen(color)
+        painter.setFont(font)
+        for left, character in zip(self.lefts.tolist(), CHARACTERS):
+            painter.drawText(int(left) + padding, padding + round(metrics.ascent()), character)
+        painter.end()
+
+        self._levels = {1.0: (self.pixmap, self.lefts, self.widths, self.height)}
+
+    # This function returns the atlas pixmap, glyph lefts, glyph widths and glyph height for the glyphs drawn at a scale
+    # Each glyph is scaled from the full size atlas into its own rectangle, so neighbouring glyphs do not bleed into each other
+    def level(self, scale):
+        if scale not in self._levels:
+            if len(self._levels) >= MAX_LEVELS:
+                self._levels = {1.0: self._levels[1.0]}
+            widths = np.ceil(self.widths * scale)
+            lefts = np.cumsum(widths) - widths
+            height = math.ceil(self.height * scale)
+            pixmap = QPixmap(max(int(widths.sum()), 1), max(height, 1))
+            pixmap.fill(Qt.transparent)
+            painter = QPainter(pixmap)
+            painter.setRenderHint(QPainter.SmoothPixmapTransform)
+            for left, scaled_left, width in zip(self.lefts.tolist(), lefts.tolist(), self.widths.tolist()):
+                painter.drawPixmap(QRectF(scaled_left, 0, width * scale, self.height * scale), self.pixmap, QRectF(left, 0, width, self.height))
+            painter.end()
+            self._levels[scale] = (pixmap, lefts, widths, height)
+        return self._levels[scale]
+
+    # This function returns the fragments that draw the IDs in ids with their top left corners at points
+    # points are in full resolution image pixels, and scale is the size of the shown image over the full resolution one
+    # The fragments are drawn from the atlas pixmap of level(scale)
+    def fragments(self, ids, points, scale):
+        _, lefts, widths, height = self.level(scale)
+        text = np.asarray(ids).astype(str)
+        lengths = np.char.str_len(text) if len(text) else np.zeros(0, dtype=np.int64)
+        glyphs = self._glyphs[np.frombuffer("".join(text.tolist()).encode(), dtype=np.uint8)]
+        labels = np.repeat(np.arange(len(text)), lengths)
+        keep = glyphs >= 0
+        glyphs, labels = glyphs[keep], labels[keep]
+
+        # Each character starts where the characters before it in the same label end
+        advances = self.advances[glyphs]
+        ends = np.cumsum(advances)
+        starts = ends - advances
+        first = np.r_[True, labels[1:] != labels[:-1]] if len(labels) else np.zeros(0, dtype=bool)
+        starts -= np.maximum.accumulate(np.where(first, starts, 0.0)) if len(labels) else 0.0
+
+        points = np.asarray(points, dtype=np.float64)
+        fragments = sip.array(QPainter.PixmapFragment, len(glyphs))
+        if len(glyphs):
+            fields = np.frombuffer(memoryview(fragments), dtype=np.float64).reshape(len(glyphs), 10)
+            # The rectangle of a glyph starts padding before the character, and the fragment position is its center
+            fields[:, 0] = (points[labels, 0] + starts - self.padding) * scale + widths[glyphs] / 2
+            fields[:, 1] = (points[labels, 1] - self.padding) * scale + height / 2
+            fields[:, 2] = lefts[glyphs]
+            fields[:, 3] = 0.0
+            fields[:, 4] = widths[glyphs]
+            fields[:, 5] = height
+            fields[:, 6:8] = 1.0
+            fields[:, 8] = 0.0
+            fields[:, 9] = 1.0
+        return fragments
+
+    # This function draws the IDs with painter, see fragments
+    def draw(self, painter, ids, points, scale):
+        fragments = self.fragments(ids, points, scale)
+        if len(fragments):
+            painter.drawPixmapFragments(fragments, self.level(scale)[0])
+
+    # This function returns a transparent layer of the given size with the IDs drawn on it, to be laid over the shown image
+    def layer(self, size, ids, points, scale):
+        pixmap = QPixmap(size)
+        pixmap.fill(Qt.transparent)
+        painter = QPainter(pixmap)
+        self.draw(painter, ids, points, scale)
+        painter.end()
+        return pixmap
@@ -0,0 +1,147 @@
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+
+from lineage_store import LineageStore, build_step_map, csv_signature, to_pixels
+from perf import timed
+
+# The lineage cache keeps the parsed columns of a tracking csv file next to it, in a <csv>.cache directory with one .npy file per array
+# Opening the csv file again memory-maps these arrays instead of parsing the file, which is most of the time a large file takes to open
+# The rows of each step are stored as an offset table: step_order lists the rows step by step, and the rows of
+# step_numbers[i] are step_order[step_starts[i]:step_starts[i + 1]]
+# meta.json names the version of the csv file the arrays were made from, a cache of another version is ignored and written again
+# The cache holds the csv file as it is on disk, unsaved edits stay in the edit journal
+
+CACHE_VERSION = 2
+
+
+# This function returns the cache directory of a csv file
+def cache_path(csv_path):
+    return csv_path + ".cache"
+
+
+# This function returns a LineageStore for a csv file from its cache, or None if there is no cache for this version of the file
+# The geometry arrays stay memory-mapped, only the id and parent_id columns are copied so they can be edited
+@timed("read_cache")
+def read_cache(csv_path, um_per_pixel):
+    directory = cache_path(csv_path)
+    try:
+        with open(os.path.join(directory, "meta.json")) as file:
+            meta = json.load(file)
+        if meta.get("version") != CACHE_VERSION or meta.get("source") != csv_signature(csv_path):
+            return None
+        arrays = {name: np.load(os.path.join(directory, name + ".npy"), mmap_mode="r") for name in meta["arrays"]}
+    except (OSError, ValueError, KeyError):
+        return None
+
+    # The pos text is left out of data and the step_map, it stays memory-mapped until a step_map export or a save needs it
+    data = pd.DataFrame({
+        "stepNum": arrays["stepNum"],
+        "id": np.array(arrays["id"]),
+        "parent_id": np.array(arrays["parent_id"]),
+    })
+    if "divideFlag" in arrays:
+        data["divideFlag"] = np.array(arrays["divideFlag"])
+    order = arrays["step_order"]
+    starts = arrays["step_starts"].tolist()
+    table = {
+        "step_rows": {step: order[starts[i]:starts[i + 1]] for i, step in enumerate(arrays["step_numbers"].tolist())},
+        "id": data["id"].to_numpy(),
+        "parent_id": data["parent_id"].to_numpy(),
+        "pos": arrays["pos"],
+        "pos_px": to_pixels(arrays["pos"], um_per_pixel),
+    }
+    if "ends" in arrays:
+        table["ends"] = arrays["ends"]
+        table["ends_px"] = to_pixels(arrays["ends"], um_per_pixel)
+
+    store = LineageStore(um_per_pixel=um_per_pixel, path=csv_path, partial=True)
+    store.extend(data, table, build_step_map(data, table))
+    store.finish()
+    store.pos_text = arrays["pos_text"]
+    return store
+
+
+# This function writes the cache of a finished LineageStore loaded from csv_path, before any edit is flushed into its data
+def write_cache(csv_path, store):
+    arrays = cache_arrays(store)
+    arrays["pos_text"] = np.array(arrays["pos_text"], dtype="S")
+    save_cache(csv_path, arrays, csv_signature(csv_path))
+
+
+# This function writes the cache on a background thread and returns the thread
+# The columns an edit could change are copied first, the geometry arrays are never changed once loaded
+def start_cache_write(csv_path, store):
+    arrays = cache_arrays(store)
+    signature = csv_signature(csv_path)
+
+    def write():
+        arrays["pos_text"] = np.array(arrays["pos_text"], dtype="S")
+        try:
+            save_cache(csv_path, arrays, signature)
+        except OSError as error:
+            print(f"Could not write the lineage cache: {error}")
+
+    thread = threading.Thread(target=write, name="LineageCacheWrite", daemon=True)
+    thread.start()
+    return thread
+
+
+# This function collects the arrays the cache holds, pos_text is still the list of "[x, y]" strings
+def cache_arrays(store):
+    step_rows = store.table["step_rows"]
+    arrays = {
+        "stepNum": store.data["stepNum"].to_numpy(dtype=np.int32, copy=True),
+        "id": store.data["id"].to_numpy(dtype=np.int32, copy=True),
+        "parent_id": store.data["parent_id"].to_numpy(dtype=np.int32, copy=True),
+        "pos": store.table["pos"],
+        "pos_text": store.data["pos"].tolist() if "pos" in store.data else store.pos_text,
+        "step_numbers": np.array(list(step_rows), dtype=np.int64),
+        "step_starts": np.r_[0, np.cumsum([len(rows) for rows in step_rows.values()], dtype=np.int64)],
+        "step_order": np.concatenate(list(step_rows.values())) if step_rows else np.zeros(0, dtype=np.intp),
+    }
+    if "ends" in store.table:
+        arrays["ends"] = store.table["ends"]
+    if "divideFlag" in store.data:
+        arrays["divideFlag"] = store.data["divideFlag"].to_numpy(dtype=bool, copy=True)
+    return arrays
+
+
+# This function writes the arrays and meta.json into a new directory and then puts it in place of the cache of an older version
+# Building the cache aside means a reader never sees it half written, even when two windows write it at once
+@timed("write_cache")
+def save_cache(csv_path, arrays, signature):
+    directory = cache_path(csv_path)
+    temporary = f"{directory}.{os.getpid()}.{threading.get_ident()}.tmp"
+    os.makedirs(temporary)
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(temporary, name + ".npy"), np.ascontiguousarray(array))
+        with open(os.path.join(temporary, "meta.json"), "w") as file:
+            json.dump({"version": CACHE_VERSION, "source": signature, "arrays": sorted(arrays)}, file)
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+        os.rename(temporary, directory)
+    finally:
+        if os.path.isdir(temporary):
+            shutil.rmtree(temporary)
+
+
+# This function writes the step_map of a store as JSON in the layout of step_map.json, for tools that read that file
+def export_step_map(store, path):
+    exported = {
+        str(step): {
+            "index": int(step_info["index"]),
+            "cell_ids": {
+                str(cell_id): {"index": int(cell_data["index"]), "parent_id": str(cell_data["parent_id"]), "pos": str(store.cell_pos(cell_data))}
+                for cell_id, cell_data in step_info["cell_ids"].items()
+            },
+        }
+        for step, step_info in sorted(store.step_map.items())
+    }
+    with open(path, "w") as file:
+        json.dump(exported, file, indent=4)
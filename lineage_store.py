@@ -0,0 +1,998 @@
+import argparse
+import bisect
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from perf import timed
+
+# This module holds the lineage data handling that does not need the GUI
+# Keeping it free of PyQt5 lets scripts, benchmarks and batch jobs on compute nodes load and correct tracking data without a display
+# LineageStore is the API, and running this file applies an edits file to many csv files at once:
+#   python lineage_store.py edits.json experiment1.csv experiment2.csv --jobs 8 --output-dir corrected
+
+DEFAULT_UM_PER_PIXEL = 0.144
+
+# These are the columns the viewer needs and the dtypes they are read with, the other columns are only read again to save
+VIEWER_COLUMNS = ["stepNum", "id", "parent_id", "divideFlag", "pos", "ends"]
+OPTIONAL_COLUMNS = ["divideFlag", "ends"] # Files without these still open, without the divide check and without selecting cells by clicking
+COLUMN_DTYPES = {"stepNum": np.int32, "id": np.int32, "parent_id": np.int32, "divideFlag": bool, "pos": str, "ends": str, "dir": str}
+CHUNK_ROWS = 100_000 # Number of rows read at a time when a csv file is loaded in chunks
+ID_LIMITS = np.iinfo(COLUMN_DTYPES["id"]) # Cell and parent ids have to fit the id and parent_id columns as they are read
+
+
+# This function raises a ValueError if a cell or parent id typed in or read from an edit does not fit ID_LIMITS
+# kind names the id in the message, such as "Cell" or "Parent"
+def check_id(value, kind="Cell"):
+    if not ID_LIMITS.min <= value <= ID_LIMITS.max:
+        raise ValueError(f"{kind} ID {value} is out of range, IDs must be between {ID_LIMITS.min} and {ID_LIMITS.max}")
+
+
+# This parses a column of "[x, y]" strings into an (N, width) float64 array in one pass
+# Joining the strings and letting NumPy parse the numbers is far faster than splitting each string in Python
+# It raises a ValueError if a row is empty or not a string, or does not hold width numbers
+def parse_vector_column(column, width):
+    missing = column.isna()
+    if missing.any():
+        raise ValueError(f"Column {column.name} has {int(missing.sum())} empty rows")
+    values = column.tolist()
+    try:
+        text = ",".join(values).replace("[", "").replace("]", "")
+    except TypeError:
+        raise ValueError(f"Column {column.name} holds values that are not text") from None
+    parsed = np.fromstring(text, sep=",") if text else np.empty(0)
+    if parsed.size != len(values) * width:
+        raise ValueError(f"Column {column.name} does not contain {width} numbers in every row")
+    return parsed.reshape(len(values), width)
+
+
+# This builds a columnar index of the tracking data
+# step_rows maps each step number to the row offsets of its cells, the other entries are one array per column
+# The geometry columns are parsed once here into float64 arrays: pos and dir are (N, 2) and ends is (N, 2, 2)
+# pos_px and ends_px are the same coordinates converted to image pixels with um_per_pixel
+# ends and dir are left out when the data was loaded without them
+def build_cell_table(data, um_per_pixel):
+    pos = parse_vector_column(data["pos"], 2)
+    table = {
+        "step_rows": data.groupby("stepNum", sort=False).indices,
+        "id": data["id"].to_numpy(),
+        "parent_id": data["parent_id"].to_numpy(),
+        "pos": pos,
+        "pos_px": to_pixels(pos, um_per_pixel),
+    }
+    if "ends" in data:
+        table["ends"] = parse_vector_column(data["ends"], 4).reshape(-1, 2, 2)
+        table["ends_px"] = to_pixels(table["ends"], um_per_pixel)
+    if "dir" in data:
+        table["dir"] = parse_vector_column(data["dir"], 2)
+    return table
+
+
+# This joins the columnar indexes of consecutive chunks of the tracking data, starts holds the first row of each chunk
+def join_cell_tables(tables, starts):
+    if len(tables) == 1:
+        return tables[0]
+    table = {key: np.concatenate([part[key] for part in tables]) for key in tables[0] if key != "step_rows"}
+    table["step_rows"] = {}
+    for part, start in zip(tables, starts):
+        for step, rows in part["step_rows"].items():
+            if step in table["step_rows"]:
+                table["step_rows"][step] = np.concatenate([table["step_rows"][step], rows + start])
+            else:
+                table["step_rows"][step] = rows + start
+    return table
+
+
+# This converts coordinates in um to whole image pixels, rounding the same way the overlay always has
+def to_pixels(coordinates, um_per_pixel):
+    return np.rint(np.asarray(coordinates) / um_per_pixel).astype(np.int32)
+
+
+# This creates a dictionary that maps the step number to the index of the row in the csv file
+# Check step_map.json for an example of what it looks like
+# start is the row of the csv file the first row of data is, when data is one chunk of a larger file
+# The entries only hold the "pos" text when data has a pos column, LineageStore.cell_pos returns it either way
+# kept marks the rows that get an entry, when some rows were left out of the step_map by edits, see LineageStore.detached_rows
+@timed("build_step_map")
+def build_step_map(data, table, start=0, kept=None):
+    ids = table["id"].tolist()
+    parent_ids = table["parent_id"].tolist()
+    positions = data["pos"].tolist() if "pos" in data else None
+
+    step_map = {}
+    for step_num, rows in table["step_rows"].items():
+        first = start + int(rows[0])
+        rows = (rows if kept is None else rows[kept[rows]]).tolist()
+        if positions is None:
+            cells = {ids[i]: {"index": start + i, "parent_id": parent_ids[i]} for i in rows}
+        else:
+            cells = {ids[i]: {"index": start + i, "parent_id": parent_ids[i], "pos": positions[i]} for i in rows}
+        step_map[int(step_num)] = {"index": first, "cell_ids": cells}
+    return step_map
+
+
+# This function returns the number of steps in a tracking csv file, the stepNum of its last row
+# Only the header and the end of the file are read, so a file that does not match the images is rejected at once
+def read_step_count(path):
+    with open(path, "rb") as file:
+        header = next(csv.reader([file.readline().decode()]))
+        file.seek(0, os.SEEK_END)
+        file.seek(max(file.tell() - 65536, 0))
+        lines = [line for line in file.read().decode(errors="replace").splitlines() if line.strip()]
+    column = header.index("stepNum") if "stepNum" in header else 0
+    try:
+        return int(next(csv.reader([lines[-1]]))[column])
+    except (IndexError, ValueError):
+        raise ValueError(f"{path} does not end with a row of tracking data")
+
+
+# This function identifies the version of a csv file by its size and modification time
+def csv_signature(path):
+    stat = os.stat(path)
+    return {"csv": os.path.abspath(path), "size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+# This function returns the columns to read from a csv file, leaving out the OPTIONAL_COLUMNS its header does not have
+# Only the header is read, a missing column that is not optional is left in so reading the file reports it
+def available_columns(path, columns):
+    header = pd.read_csv(path, nrows=0).columns
+    return [column for column in columns if column in header or column not in OPTIONAL_COLUMNS]
+
+
+# This function reads a tracking csv file in chunks and yields each chunk with the fraction of the file read so far
+# Chunks end on a step boundary, the rows of the last step of a chunk are held back until the next chunk completes the step
+# Only columns are read, with the dtypes in COLUMN_DTYPES, see available_columns for the ones the file may not have
+def iter_step_chunks(path, columns=VIEWER_COLUMNS, chunk_rows=CHUNK_ROWS):
+    size = max(os.path.getsize(path), 1)
+    columns = available_columns(path, columns)
+    dtypes = {column: COLUMN_DTYPES[column] for column in columns if column in COLUMN_DTYPES}
+    with open(path, "rb") as file:
+        held = None
+        for chunk in pd.read_csv(file, usecols=columns, dtype=dtypes, chunksize=chunk_rows):
+            if held is not None:
+                chunk = pd.concat([held, chunk])
+            steps = chunk["stepNum"].to_numpy()
+            cut = len(steps) - int(np.argmax(steps[::-1] != steps[-1])) if np.any(steps != steps[-1]) else 0
+            held = chunk.iloc[cut:]
+            if cut:
+                yield chunk.iloc[:cut], min(file.tell() / size, 1.0)
+        if held is not None and len(held):
+            yield held, 1.0
+
+
+# This function builds the columnar index and step_map of a chunk of tracking data whose first row is row start of the file
+# It is the expensive part of LineageStore.extend, so a loader thread can run it and hand the result to the GUI thread
+@timed("parse_chunk")
+def prepare_chunk(chunk, start, um_per_pixel):
+    table = build_cell_table(chunk, um_per_pixel)
+    return chunk, table, build_step_map(chunk, table, start)
+
+
+# This builds the reverse index used to edit the step_map without scanning every step
+# id_steps maps a cell id to the steps it appears in, children maps a parent id to the (step, cell id) of its children
+def build_edit_index(step_map):
+    id_steps = {}
+    children = {}
+    for step, step_data in step_map.items():
+        for cell_id, cell_data in step_data["cell_ids"].items():
+            id_steps.setdefault(cell_id, set()).add(step)
+            children.setdefault(cell_data["parent_id"], set()).add((step, cell_id))
+    return {"id_steps": id_steps, "children": children}
+
+
+# This renames old_cell_id to new_cell_id in from_step and every later step, and points its children at the new id
+# If new_cell_id already exists in a step, the renamed cell replaces it there
+# It returns the steps that were changed, records every changed cell in dirty when it is given,
+# and appends the changes to changes when it is given so they can be undone
+def relabel_cell(step_map, index, from_step, old_cell_id, new_cell_id, dirty=None, changes=None):
+    children = index["children"]
+    renamed = set()
+
+    for step in [step for step in index["id_steps"].get(old_cell_id, ()) if step >= from_step]:
+        displaced = move_cell(step_map, index, step, old_cell_id, new_cell_id, dirty)
+        renamed.add(step)
+        if changes is not None:
+            changes.append(("rename", step, old_cell_id, new_cell_id, displaced))
+
+    # Because the old_cell_id changed to the new_cell_id, the parent of all of its children changes too
+    # The renamed cell itself is not one of its children, even if it was its own parent
+    changed = set(renamed)
+    moved = [child for child in children.get(old_cell_id, ()) if child[0] >= from_step and not (child[1] == new_cell_id and child[0] in renamed)]
+    for step, cell_id in moved:
+        set_parent(step_map, index, step, cell_id, new_cell_id, dirty)
+        changed.add(step)
+        if changes is not None:
+            changes.append(("parent", step, cell_id, old_cell_id, new_cell_id))
+    return changed
+
+
+# This sets the parent of cell_id to new_parent_id in from_step and every later step it appears in
+# It returns the steps that were changed, and records dirty cells and changes like relabel_cell
+def reparent_cell(step_map, index, from_step, cell_id, new_parent_id, dirty=None, changes=None):
+    changed = set()
+
+    for step in [step for step in index["id_steps"].get(cell_id, ()) if step >= from_step]:
+        old_parent_id = set_parent(step_map, index, step, cell_id, new_parent_id, dirty)
+        changed.add(step)
+        if changes is not None:
+            changes.append(("parent", step, cell_id, old_parent_id, new_parent_id))
+    return changed
+
+
+# This adds a cell that has no row of its own to a step, replacing a cell with the same id there, which stays dirty like in move_cell
+# It returns the steps that were changed, and records dirty cells and changes like relabel_cell
+def add_cell(step_map, index, step, cell_id, cell_data, dirty=None, changes=None):
+    displaced = step_map[step]["cell_ids"].get(cell_id)
+    if displaced is not None:
+        index["children"][displaced["parent_id"]].discard((step, cell_id))
+    put_cell(step_map, index, step, cell_id, cell_data, dirty)
+    if changes is not None:
+        changes.append(("add", step, cell_id, cell_data, displaced))
+    return {step}
+
+
+# This applies one edit operation, a dictionary as it is stored in the edit journal
+# "change" is what the Change Cell Info button does: relabel the cell if its id changed, then reparent it if its parent changed
+# "add" is a cell added by clicking on the image, it has only a position and no row in the csv file, so flush never writes it
+# Its index is the first row of its step, only so that looking the cells of a step up by row stays valid
+# It raises a ValueError if the cell the operation edits is not in its step, or an id it sets does not fit ID_LIMITS
+def apply_operation(step_map, index, operation, dirty=None, changes=None):
+    kind = operation["op"]
+    step = operation["step"]
+    if kind in ("relabel", "change"):
+        check_id(operation["new"])
+    if kind == "add":
+        check_id(operation["cell"])
+    if kind in ("reparent", "change", "add"):
+        check_id(operation["parent"], "Parent")
+    if kind == "add":
+        if step not in step_map:
+            raise ValueError(f"Cannot add cell {operation['cell']} to step {step}, there is no such step")
+        cell_data = {"index": step_map[step]["index"], "parent_id": operation["parent"], "pos": operation["pos"], "added": True}
+        return add_cell(step_map, index, step, operation["cell"], cell_data, dirty, changes)
+    cell_id = operation["cell"] if kind == "reparent" else operation.get("old")
+    if kind in ("relabel", "reparent", "change") and cell_id not in step_map.get(step, {}).get("cell_ids", {}):
+        raise ValueError(f"Cannot {kind} cell {cell_id} in step {step}, the step has no such cell")
+    if kind == "relabel":
+        return relabel_cell(step_map, index, step, operation["old"], operation["new"], dirty, changes)
+    if kind == "reparent":
+        return reparent_cell(step_map, index, step, operation["cell"], operation["parent"], dirty, changes)
+    if kind == "change":
+        changed = set()
+        if operation["new"] != operation["old"]:
+            changed |= relabel_cell(step_map, index, step, operation["old"], operation["new"], dirty, changes)
+        if operation["parent"] != step_map[step]["cell_ids"][operation["new"]]["parent_id"]:
+            changed |= reparent_cell(step_map, index, step, operation["new"], operation["parent"], dirty, changes)
+        return changed
+    raise ValueError(f"Unknown edit operation: {kind}")
+
+
+# This reverts changes recorded by relabel_cell, reparent_cell and add_cell, newest first, and returns the steps that were changed
+def undo_changes(step_map, index, changes, dirty=None):
+    for change in reversed(changes):
+        if change[0] == "rename":
+            _, step, old_cell_id, new_cell_id, displaced = change
+            move_cell(step_map, index, step, new_cell_id, old_cell_id, dirty)
+            if displaced is not None:
+                put_cell(step_map, index, step, new_cell_id, displaced, dirty)
+        elif change[0] == "add":
+            _, step, cell_id, _, displaced = change
+            remove_cell(step_map, index, step, cell_id)
+            if displaced is not None:
+                put_cell(step_map, index, step, cell_id, displaced, dirty)
+        else:
+            _, step, cell_id, old_parent_id, _ = change
+            set_parent(step_map, index, step, cell_id, old_parent_id, dirty)
+    return {change[1] for change in changes}
+
+
+# This applies changes recorded by relabel_cell, reparent_cell and add_cell again after they were undone
+def redo_changes(step_map, index, changes, dirty=None):
+    for change in changes:
+        if change[0] == "rename":
+            _, step, old_cell_id, new_cell_id, _ = change
+            move_cell(step_map, index, step, old_cell_id, new_cell_id, dirty)
+        elif change[0] == "add":
+            _, step, cell_id, cell_data, _ = change
+            add_cell(step_map, index, step, cell_id, cell_data, dirty)
+        else:
+            _, step, cell_id, _, new_parent_id = change
+            set_parent(step_map, index, step, cell_id, new_parent_id, dirty)
+    return {change[1] for change in changes}
+
+
+# This moves the entry of from_id in one step to to_id and keeps the reverse index and dirty cells up to date
+# It returns the entry that was at to_id before, if there was one
+# That entry stays dirty if it was, so its row is saved with the values it had when it was replaced, whether or not a flush came in between
+def move_cell(step_map, index, step, from_id, to_id, dirty=None):
+    cells = step_map[step]["cell_ids"]
+    children = index["children"]
+    displaced = cells.get(to_id)
+    if displaced is not None:
+        children[displaced["parent_id"]].discard((step, to_id))
+
+    cell_data = cells.pop(from_id)
+    cells[to_id] = cell_data
+    index["id_steps"][from_id].discard(step)
+    index["id_steps"].setdefault(to_id, set()).add(step)
+    children[cell_data["parent_id"]].discard((step, from_id))
+    children[cell_data["parent_id"]].add((step, to_id))
+    if dirty is not None:
+        mark_dirty(dirty, to_id, cell_data)
+    return displaced
+
+
+# This puts an entry back into a step, it is how undo restores a cell that a rename replaced
+def put_cell(step_map, index, step, cell_id, cell_data, dirty=None):
+    step_map[step]["cell_ids"][cell_id] = cell_data
+    index["id_steps"].setdefault(cell_id, set()).add(step)
+    index["children"].setdefault(cell_data["parent_id"], set()).add((step, cell_id))
+    if dirty is not None:
+        mark_dirty(dirty, cell_id, cell_data)
+
+
+# This takes an entry out of a step, it is how undo removes a cell that was added
+def remove_cell(step_map, index, step, cell_id):
+    cell_data = step_map[step]["cell_ids"].pop(cell_id)
+    index["id_steps"][cell_id].discard(step)
+    index["children"][cell_data["parent_id"]].discard((step, cell_id))
+
+
+# This sets the parent of a cell in one step, keeps the reverse index and dirty cells up to date and returns the old parent
+def set_parent(step_map, index, step, cell_id, parent_id, dirty=None):
+    cell_data = step_map[step]["cell_ids"][cell_id]
+    old_parent_id = cell_data["parent_id"]
+    index["children"][old_parent_id].discard((step, cell_id))
+    index["children"].setdefault(parent_id, set()).add((step, cell_id))
+    cell_data["parent_id"] = parent_id
+    if dirty is not None:
+        mark_dirty(dirty, cell_id, cell_data)
+    return old_parent_id
+
+
+# Dirty cells are the step_map entries whose row in the csv file no longer matches them
+# dirty maps the row index to the current cell id and the step_map entry, which holds the current parent_id
+# Added cells have no row of their own, so they are never dirty
+def mark_dirty(dirty, cell_id, cell_data):
+    if not cell_data.get("added"):
+        dirty[cell_data["index"]] = (cell_id, cell_data)
+
+
+# This writes the dirty cells back into the csv data with one vectorized assignment per column, then clears them
+def apply_dirty(data, dirty):
+    if not dirty:
+        return
+    rows = np.fromiter(dirty, dtype=np.intp, count=len(dirty))
+    # The values are cast to the column dtype, which is int32 when the data was read with COLUMN_DTYPES
+    ids = np.array([cell_id for cell_id, _ in dirty.values()], dtype=data["id"].dtype)
+    parent_ids = np.array([cell_data["parent_id"] for _, cell_data in dirty.values()], dtype=data["parent_id"].dtype)
+    data.iloc[rows, data.columns.get_loc("id")] = ids
+    data.iloc[rows, data.columns.get_loc("parent_id")] = parent_ids
+    dirty.clear()
+
+
+# This writes the tracking data to a file, the extension picks the format
+# Parquet and Feather keep the same columns as the csv file but are much faster to write, they need pyarrow
+def save_table(data, filename):
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == ".parquet":
+        data.to_parquet(filename, index=False)
+    elif extension == ".feather":
+        data.to_feather(filename)
+    else:
+        data.to_csv(filename, index=False)
+
+
+# This function returns which values are in members, like np.isin, through a lookup table over the range of the values
+# Cell ids span a small range, so this is one pass over each array instead of sorting or hashing them
+def member_mask(values, members):
+    values = np.asarray(values, dtype=np.int64)
+    members = np.asarray(members, dtype=np.int64)
+    if not len(values) or not len(members):
+        return np.zeros(len(values), dtype=bool)
+    low = min(int(values.min()), int(members.min()))
+    span = max(int(values.max()), int(members.max())) - low + 1
+    if span > 8 * (len(values) + len(members)):
+        return np.isin(values, members) # The ids are too sparse for a table
+    table = np.zeros(span, dtype=bool)
+    table[members - low] = True
+    return table[values - low]
+
+
+# This function returns the distinct values of an integer array in order
+# It sorts instead of calling np.unique, which hashes the values and is several times slower on these arrays
+# Given the size of a table the values index, such as the number of rows, many values are deduplicated by marking them in a table instead
+def sorted_unique(values, size=None):
+    if size is not None and len(values) * 8 > size:
+        table = np.zeros(size, dtype=bool)
+        table[values] = True
+        return np.flatnonzero(table)
+    values = np.sort(values)
+    return values[np.r_[True, values[1:] != values[:-1]]] if len(values) else values
+
+
+# This function finds the lineage problems in rows of tracking data and returns them sorted by step and cell id
+# Each problem is a dictionary with the step, the cell id, a message and its kind, which is one of
+#   "duplicate": the cell id appears more than once in the step
+#   "orphan": the cell first appears with a parent that is neither 0 nor in the step before
+#   "parent": the cell's parent changes while it lives
+#   "divide": the cell's divideFlag does not match whether it has children, reported at its last step
+# The checks are group operations over the rows sorted by cell id and step, so a million rows take a fraction of a second
+# When the rows are only part of the data, all_steps are the step numbers of every row, to find the step before a step,
+# all_parent_ids are parent_ids of other rows that include every parent among ids, to find which cells have children,
+# and only the problems in report_steps or of report_cells are returned
+def find_lineage_problems(steps, ids, parent_ids, divide_flags=None, all_steps=None, all_parent_ids=None, report_steps=None, report_cells=None):
+    steps = np.asarray(steps, dtype=np.int64)
+    ids = np.asarray(ids, dtype=np.int64)
+    parent_ids = np.asarray(parent_ids, dtype=np.int64)
+    if not len(ids):
+        return []
+    found = [] # The kind, steps, cell ids and messages of each kind of problem found
+
+    # The rows of a cell are next to each other in this order, from its first step to its last
+    order = np.lexsort((steps, ids))
+    cell_ids, cell_steps, cell_parents = ids[order], steps[order], parent_ids[order]
+    same_cell = cell_ids[1:] == cell_ids[:-1]
+    same_step = same_cell & (cell_steps[1:] == cell_steps[:-1])
+
+    # Every repeated id is reported once per step
+    repeated = np.flatnonzero(same_step & ~np.r_[False, same_step[:-1]]) + 1
+    found.append(("duplicate", cell_steps[repeated], cell_ids[repeated], ["id appears more than once in the step"] * len(repeated)))
+
+    changed = np.flatnonzero(same_cell & ~same_step & (cell_parents[1:] != cell_parents[:-1])) + 1
+    found.append(("parent", cell_steps[changed], cell_ids[changed],
+                  [f"parent changed from {old} to {new}" for old, new in zip(cell_parents[changed - 1].tolist(), cell_parents[changed].tolist())]))
+
+    # A row's key is its cell id and step rank, so the keys in this order are sorted and a parent is looked up with a binary search
+    if all_steps is None:
+        step_numbers = np.flatnonzero(np.bincount(steps - steps.min())) + steps.min()
+    else:
+        step_numbers = np.unique(all_steps)
+    low = min(int(ids.min()), int(parent_ids.min()))
+    keys = (cell_ids - low) * len(step_numbers) + np.searchsorted(step_numbers, cell_steps)
+    first = np.flatnonzero(np.r_[True, ~same_cell])
+    previous = np.searchsorted(step_numbers, cell_steps[first]) - 1
+    wanted = (cell_parents[first] - low) * len(step_numbers) + previous
+    position = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+    present = (previous >= 0) & (cell_parents[first] >= low) & (keys[position] == wanted)
+    orphan = (cell_parents[first] != 0) & ~present
+    orphans = first[orphan]
+    previous_steps = np.where(previous >= 0, step_numbers[np.maximum(previous, 0)], cell_steps[first] - 1)[orphan]
+    found.append(("orphan", cell_steps[orphans], cell_ids[orphans],
+                  [f"parent {parent} is not in step {step}" for parent, step in zip(cell_parents[orphans].tolist(), previous_steps.tolist())]))
+
+    if divide_flags is not None:
+        last = np.flatnonzero(np.r_[~same_cell, True])
+        divides = np.asarray(divide_flags, dtype=bool)[order][last]
+        has_children = member_mask(cell_ids[last], parent_ids if all_parent_ids is None else np.asarray(all_parent_ids))
+        wrong = last[divides != has_children]
+        found.append(("divide", cell_steps[wrong], cell_ids[wrong],
+                      ["divideFlag is TRUE but the cell has no children" if flag else "divideFlag is FALSE but the cell has children"
+                       for flag in divides[divides != has_children].tolist()]))
+
+    kinds = [kind for kind, _, _, messages in found for _ in messages]
+    problem_steps = np.concatenate([group[1] for group in found])
+    problem_ids = np.concatenate([group[2] for group in found])
+    messages = [message for group in found for message in group[3]]
+    keep = np.ones(len(problem_steps), dtype=bool)
+    if report_steps is not None:
+        keep = np.isin(problem_steps, report_steps) | member_mask(problem_ids, report_cells)
+    sort = np.flatnonzero(keep)[np.lexsort((problem_ids[keep], problem_steps[keep]))]
+    return [{"step": step, "id": cell_id, "problem": messages[i], "kind": kinds[i]}
+            for step, cell_id, i in zip(problem_steps[sort].tolist(), problem_ids[sort].tolist(), sort.tolist())]
+
+
+# This is a uniform grid over the cells of one step, used to find the cell under a point such as a mouse click
+# Every cell is the segment between its two ends and is listed in each grid square its bounding box touches,
+# so a lookup only measures the distance to the few cells in the squares near the point
+class CellGrid:
+
+    # ids are the cell ids and ends an (N, 2, 2) array of the two ends of each cell, in um
+    # cell_size is the side of a grid square, by default the median cell length so most cells touch one to four squares
+    def __init__(self, ids, ends, cell_size=None):
+        self.ids = np.asarray(ids)
+        self.ends = np.asarray(ends, dtype=np.float64).reshape(-1, 2, 2)
+        if cell_size is None:
+            lengths = np.linalg.norm(self.ends[:, 0] - self.ends[:, 1], axis=1)
+            cell_size = float(np.median(lengths)) if len(lengths) else 1.0
+        self.cell_size = max(cell_size, 1e-6)
+
+        low = self.ends.min(axis=1)
+        high = self.ends.max(axis=1)
+        self.origin = low.min(axis=0) if len(low) else np.zeros(2)
+        first = np.floor((low - self.origin) / self.cell_size).astype(np.int64)
+        last = np.floor((high - self.origin) / self.cell_size).astype(np.int64)
+        self.shape = (last.max(axis=0) + 1) if len(last) else np.ones(2, dtype=np.int64)
+
+        # Every cell is repeated once per square of its bounding box, then the entries are grouped by square
+        widths = last[:, 0] - first[:, 0] + 1
+        counts = widths * (last[:, 1] - first[:, 1] + 1)
+        cells = np.repeat(np.arange(len(counts)), counts)
+        local = np.arange(len(cells)) - np.repeat(np.cumsum(counts) - counts, counts)
+        squares_x = first[cells, 0] + local % widths[cells]
+        squares_y = first[cells, 1] + local // widths[cells]
+        squares = squares_y * self.shape[0] + squares_x
+        order = np.argsort(squares, kind="stable")
+        self.square_cells = cells[order] # Indices of the cells in every square, grouped by square
+        self.square_offsets = np.r_[0, np.cumsum(np.bincount(squares, minlength=int(self.shape[0] * self.shape[1])))]
+
+    # This function returns the id of the cell closest to point and its distance, or None if no cell is within tolerance
+    def nearest(self, point, tolerance):
+        point = np.asarray(point, dtype=np.float64)
+        first = np.maximum(np.floor((point - tolerance - self.origin) / self.cell_size).astype(np.int64), 0)
+        last = np.minimum(np.floor((point + tolerance - self.origin) / self.cell_size).astype(np.int64), self.shape - 1)
+        if np.any(first > last):
+            return None
+
+        candidates = [
+            self.square_cells[self.square_offsets[square]:self.square_offsets[square + 1]]
+            for y in range(first[1], last[1] + 1)
+            for square in range(y * self.shape[0] + first[0], y * self.shape[0] + last[0] + 1)
+        ]
+        candidates = np.unique(np.concatenate(candidates))
+        if len(candidates) == 0:
+            return None
+
+        distances = segment_distances(point, self.ends[candidates])
+        best = int(np.argmin(distances))
+        if distances[best] > tolerance:
+            return None
+        return self.ids[candidates[best]].item(), float(distances[best])
+
+
+# This function returns the distance from a point to each segment of an (N, 2, 2) array
+def segment_distances(point, segments):
+    start = segments[:, 0]
+    direction = segments[:, 1] - start
+    length_squared = np.einsum("ij,ij->i", direction, direction)
+    along = np.einsum("ij,ij->i", point - start, direction) / np.where(length_squared > 0, length_squared, 1.0)
+    closest = start + np.clip(along, 0.0, 1.0)[:, None] * direction
+    return np.linalg.norm(closest - point, axis=1)
+
+
+# This is the lineage graph: every cell id with its first and last step, its parent and its children
+# Everything is stored in arrays ordered by cell id, and the children of all cells share one array with an offset per cell,
+# so looking a cell up is a binary search and its children are a slice
+class LineageTree:
+
+    # steps, ids and parent_ids are one entry per row of the tracking data
+    # A cell's parent is the parent_id of its first row
+    def __init__(self, steps, ids, parent_ids):
+        steps = np.asarray(steps)
+        ids = np.asarray(ids)
+        parent_ids = np.asarray(parent_ids)
+
+        self.cell_ids, inverse = np.unique(ids, return_inverse=True)
+        order = np.lexsort((steps, inverse))
+        starts = np.flatnonzero(np.r_[True, np.diff(inverse[order]) != 0])
+        ends = np.r_[starts[1:], len(order)] - 1
+        self.first_step = steps[order[starts]]
+        self.last_step = steps[order[ends]]
+        self.parent_ids = parent_ids[order[starts]]
+
+        # A parent that never appears as a cell, like 0 for the first cells, has no entry and so no children list
+        parent_index = np.searchsorted(self.cell_ids, self.parent_ids)
+        has_parent = (parent_index < len(self.cell_ids)) & (self.cell_ids[np.minimum(parent_index, len(self.cell_ids) - 1)] == self.parent_ids)
+        child_order = np.flatnonzero(has_parent)
+        child_order = child_order[np.argsort(parent_index[child_order], kind="stable")]
+        self.children_of = child_order # Indices of the children of every cell, grouped by parent
+        self.child_offsets = np.r_[0, np.cumsum(np.bincount(parent_index[has_parent], minlength=len(self.cell_ids)))]
+
+    # This function returns the position of a cell id in the arrays, or None if there is no such cell
+    def find(self, cell_id):
+        i = int(np.searchsorted(self.cell_ids, cell_id))
+        if i < len(self.cell_ids) and self.cell_ids[i] == cell_id:
+            return i
+        return None
+
+    # This function returns the first and last step of a cell
+    def lifespan(self, cell_id):
+        i = self.find(cell_id)
+        if i is None:
+            return None
+        return int(self.first_step[i]), int(self.last_step[i])
+
+    # This function returns the ids of the direct children of a cell
+    def children(self, cell_id):
+        i = self.find(cell_id)
+        if i is None:
+            return self.cell_ids[:0]
+        return self.cell_ids[self.children_of[self.child_offsets[i]:self.child_offsets[i + 1]]]
+
+    # This function returns the ids of every descendant of a cell, generation by generation
+    def descendants(self, cell_id):
+        i = self.find(cell_id)
+        if i is None:
+            return self.cell_ids[:0]
+        found = []
+        generation = [i]
+        seen = {i}
+        while generation:
+            next_generation = []
+            for parent in generation:
+                for child in self.children_of[self.child_offsets[parent]:self.child_offsets[parent + 1]].tolist():
+                    if child not in seen:  # Guards against cycles an edit may have created
+                        seen.add(child)
+                        next_generation.append(child)
+            found.extend(next_generation)
+            generation = next_generation
+        return self.cell_ids[found]
+
+    # This function returns the ids of the ancestors of a cell, from its parent back to the first generation
+    def ancestors(self, cell_id):
+        chain = []
+        i = self.find(cell_id)
+        seen = set()
+        while i is not None and i not in seen:
+            seen.add(i)
+            i = self.find(self.parent_ids[i])
+            if i is not None:
+                chain.append(i)
+        return self.cell_ids[chain]
+
+
+# This finds the rows of the tracking data that hold any of some values in one column, such as the rows of a few cell ids,
+# in time that grows with the rows found instead of with the column
+# The rows are sorted by value once, rows whose value changed since then are kept aside and searched directly
+class RowIndex:
+
+    def __init__(self, column):
+        self.order = np.argsort(column, kind="stable")
+        self.sorted = column[self.order]
+        self.stale = np.zeros(len(column), dtype=bool) # This marks the rows whose value may have changed since the sort
+        self.stale_rows = np.zeros(0, dtype=np.intp)
+
+    # This function records rows whose value may change, it has to be called before the column is changed
+    def update(self, rows):
+        rows = rows[~self.stale[rows]]
+        self.stale[rows] = True
+        self.stale_rows = np.concatenate([self.stale_rows, rows])
+
+    # This function returns the rows whose value in column, the current column, is one of values
+    # Looking many values up costs more than one pass over the column, so those are found with member_mask instead
+    def rows(self, values, column):
+        if len(values) * 8 > len(column):
+            return np.flatnonzero(member_mask(column, values))
+        values = sorted_unique(np.asarray(values, dtype=self.sorted.dtype))
+        starts = np.searchsorted(self.sorted, values, side="left")
+        counts = np.searchsorted(self.sorted, values, side="right") - starts
+        # This is every position from starts[i] to starts[i] + counts[i], for all i at once
+        positions = np.arange(counts.sum()) + np.repeat(starts - np.cumsum(counts) + counts, counts)
+        found = self.order[positions]
+        found = found[~self.stale[found]]
+        return np.concatenate([found, self.stale_rows[member_mask(column[self.stale_rows], values)]])
+
+
+# This is one loaded lineage: the tracking data, its columnar index and the step_map, with the edits made to them
+# A store made without data is filled chunk by chunk with extend, and can be shown while it fills, finish completes it
+class LineageStore:
+
+    # partial tells that data holds only some columns of the file at path, saving then reads the other columns from the file
+    def __init__(self, data=None, um_per_pixel=DEFAULT_UM_PER_PIXEL, path=None, partial=False):
+        self.path = path # This is the file the data was loaded from, if any
+        self.um_per_pixel = um_per_pixel
+        self.partial = partial
+        self.signature = csv_signature(path) if partial else None # This is the version of the file the other columns are read from to save
+        self.data = None # This is the tracking data in a pandas dataframe, edits reach it on flush or save
+        self.table = None # This is the columnar index, see build_cell_table
+        self.step_map = {} # This maps the step number to its cells, check step_map.json for an example
+        self.dirty = {} # This maps the csv row of every edited cell to its current id and step_map entry, see mark_dirty
+        self.problems = {} # This maps a step to the lineage problems found in it by check
+        self.pos_text = None # This is the "[x, y]" text of every row as bytes, for a store read from the lineage cache without a pos column
+        self.rows_loaded = 0
+        self._edit_index = None
+        self._lineage = None
+        self._row_index = None
+        self._chunks = [] # The data, columnar index and first row of the chunks received by extend, until finish joins them
+        self._tables = []
+        self._starts = []
+        if data is not None:
+            self.extend(data)
+            self.finish()
+
+    # This function loads a tracking csv file
+    # expected_steps is the number of images the data has to cover, the last stepNum must match it
+    # Passing columns reads only those columns, saving then reads the other columns from the file again
+    @classmethod
+    @timed("load_csv")
+    def load(cls, path, um_per_pixel=DEFAULT_UM_PER_PIXEL, expected_steps=None, columns=None):
+        if expected_steps is not None and read_step_count(path) != expected_steps:
+            raise ValueError(f"{path} has {read_step_count(path)} steps but {expected_steps} images were expected")
+        if columns is None:
+            return cls(pd.read_csv(path), um_per_pixel, path)
+        columns = available_columns(path, columns)
+        dtypes = {column: COLUMN_DTYPES[column] for column in columns if column in COLUMN_DTYPES}
+        return cls(pd.read_csv(path, usecols=columns, dtype=dtypes), um_per_pixel, path, partial=True)
+
+    # This function adds the next chunk of the tracking data and returns the steps it holds
+    # table and step_map are the result of prepare_chunk when it already ran on another thread
+    def extend(self, chunk, table=None, step_map=None):
+        if table is None:
+            chunk, table, step_map = prepare_chunk(chunk, self.rows_loaded, self.um_per_pixel)
+        for step, step_info in step_map.items():
+            if step in self.step_map:
+                self.step_map[step]["cell_ids"].update(step_info["cell_ids"]) # The step was split between two chunks
+            else:
+                self.step_map[step] = step_info
+        self._chunks.append(chunk)
+        self._tables.append(table)
+        self._starts.append(self.rows_loaded)
+        self.rows_loaded += len(chunk)
+        return sorted(step_map)
+
+    # This function joins the chunks once all of them were added, edits and lineage queries need a finished store
+    def finish(self):
+        if len(self._chunks) == 1:
+            self.data = self._chunks[0].reset_index(drop=True)
+        else:
+            self.data = pd.concat(self._chunks, ignore_index=True)
+        self.table = join_cell_tables(self._tables, self._starts)
+        self._chunks, self._tables, self._starts = [], [], []
+        self._lineage = LineageTree(self.data["stepNum"].to_numpy(), self.table["id"], self.table["parent_id"])
+
+    # This function rebuilds the index after the id and parent_id columns of data were replaced, for example from a snapshot
+    # detached are the rows that have no entry in the step_map, as detached_rows returned them when the columns were saved
+    # The step_map is updated in place, so references to it stay valid
+    def reindex(self, detached=()):
+        self.table["id"] = self.data["id"].to_numpy()
+        self.table["parent_id"] = self.data["parent_id"].to_numpy()
+        kept = None
+        if len(detached):
+            kept = np.ones(len(self.data), dtype=bool)
+            kept[np.asarray(detached, dtype=np.intp)] = False
+        self.step_map.clear()
+        self.step_map.update(build_step_map(self.data, self.table, kept=kept))
+        self.dirty = {}
+        self._edit_index = None
+        self._row_index = None
+        self._lineage = LineageTree(self.data["stepNum"].to_numpy(), self.table["id"], self.table["parent_id"])
+
+    # This function returns the values of a column of the columnar index for one row or an array of rows of the csv file
+    # While the store is filling the rows of one call must come from the same chunk, which the rows of one step always do
+    def cell_values(self, column, rows):
+        if self.table is not None:
+            return self.table[column][rows]
+        first = np.asarray(rows).flat[0] if np.size(rows) else 0
+        chunk = bisect.bisect_right(self._starts, first) - 1
+        return self._tables[chunk][column][np.asarray(rows) - self._starts[chunk]]
+
+    # This function returns the position of a cell as the "[x, y]" text of the csv file
+    def cell_pos(self, cell_data):
+        if "pos" in cell_data:
+            return cell_data["pos"]
+        if self.pos_text is not None:
+            return self.pos_text[cell_data["index"]].decode()
+        return self.data["pos"].iat[cell_data["index"]]
+
+    # This function returns the rows of the tracking data that no step_map entry points to, in order
+    # They are the rows of cells a rename or an added cell replaced, and all but the last row of an id that appears twice in a step of the file
+    # The ids alone cannot tell which of the rows with the same id in a step is in the step_map, so reindex needs these rows too
+    def detached_rows(self):
+        rows = np.fromiter((cell_data["index"] for step_info in self.step_map.values() for cell_data in step_info["cell_ids"].values()
+                            if not cell_data.get("added")), dtype=np.intp)
+        detached = np.ones(len(self.data), dtype=bool)
+        detached[rows] = False
+        return np.flatnonzero(detached)
+
+    # This function tells whether the columnar index has a column, ends and dir are only there when the file has them
+    def has_column(self, column):
+        tables = [self.table] if self.table is not None else self._tables
+        return bool(tables) and column in tables[0]
+
+    # This is the reverse index used by the edits, it is built on the first edit
+    @property
+    def edit_index(self):
+        if self._edit_index is None:
+            self._edit_index = build_edit_index(self.step_map)
+        return self._edit_index
+
+    # These are the RowIndex of the id and the parent_id column, used by the incremental checks
+    # They are built on the first check and again once a tenth of the rows changed since
+    @property
+    def row_index(self):
+        if self._row_index is None or len(self._row_index["id"].stale_rows) > len(self.data) // 10:
+            self.flush()
+            self._row_index = {column: RowIndex(self.data[column].to_numpy()) for column in ("id", "parent_id")}
+        return self._row_index
+
+    # This is the LineageTree of the current ids and parents, it is built at load and again on the first query after an edit
+    @property
+    def lineage(self):
+        if self._lineage is None:
+            self.flush()
+            self._lineage = LineageTree(self.data["stepNum"].to_numpy(), self.data["id"].to_numpy(), self.data["parent_id"].to_numpy())
+        return self._lineage
+
+    # This function renames a cell from step onwards and returns the changed steps, see relabel_cell
+    def relabel(self, step, old_cell_id, new_cell_id, changes=None):
+        self._lineage = None
+        return relabel_cell(self.step_map, self.edit_index, step, old_cell_id, new_cell_id, self.dirty, changes)
+
+    # This function sets the parent of a cell from step onwards and returns the changed steps, see reparent_cell
+    def reparent(self, step, cell_id, new_parent_id, changes=None):
+        self._lineage = None
+        return reparent_cell(self.step_map, self.edit_index, step, cell_id, new_parent_id, self.dirty, changes)
+
+    # This function applies an edit operation as it is stored in the edit journal or an edits file, see apply_operation
+    def apply(self, operation, changes=None):
+        self._lineage = None
+        return apply_operation(self.step_map, self.edit_index, operation, self.dirty, changes)
+
+    # This function reverts changes recorded by an edit and returns the changed steps
+    def undo(self, changes):
+        self._lineage = None
+        return undo_changes(self.step_map, self.edit_index, changes, self.dirty)
+
+    # This function applies changes recorded by an edit again and returns the changed steps
+    def redo(self, changes):
+        self._lineage = None
+        return redo_changes(self.step_map, self.edit_index, changes, self.dirty)
+
+    # This function checks the lineage and returns a list of problems, see find_lineage_problems
+    # Given the steps an edit changed, only the problems the edit can change are looked for, see check_scope
+    def validate(self, steps=None):
+        if steps is None:
+            self.flush()
+            return find_lineage_problems(self.data["stepNum"].to_numpy(), self.data["id"].to_numpy(), self.data["parent_id"].to_numpy(),
+                                         self.data["divideFlag"].to_numpy() if "divideFlag" in self.data else None)
+        return self.validate_scope(*self.check_scope(steps))
+
+    # This function returns the steps and cell ids whose problems an edit of the given steps can change, the ids may repeat
+    # These are the edited steps and the steps next to them, and every cell and parent in them, before and after the edit
+    # The ids before the edit are still in the rows of the dirty cells, so this has to be called before the edit is flushed
+    def check_scope(self, steps):
+        dirty_rows = np.fromiter(self.dirty, dtype=np.intp, count=len(self.dirty))
+        earlier = [self.data["id"].to_numpy()[dirty_rows], self.data["parent_id"].to_numpy()[dirty_rows]]
+        self.flush()
+        checked = self.neighbour_steps(steps)
+        step_rows = self.table["step_rows"]
+        rows = np.concatenate([step_rows[step] for step in checked] + [np.zeros(0, dtype=np.intp)])
+        cells = np.concatenate([self.data["id"].to_numpy()[rows], self.data["parent_id"].to_numpy()[rows]] + earlier)
+        return checked, cells
+
+    # This function returns the problems in the checked steps and of the cells, looking only at the rows it needs for them:
+    # the rows of the cells and of their parents, the rows of the step before each checked step, and the rows of their children
+    # The rows are found with row_index and step_rows, so the work grows with the rows the edit reaches rather than with the data
+    def validate_scope(self, checked, cells):
+        row_index = self.row_index
+        self.flush()
+        step_numbers = self.data["stepNum"].to_numpy()
+        ids = self.data["id"].to_numpy()
+        parent_ids = self.data["parent_id"].to_numpy()
+        divide_flags = self.data["divideFlag"].to_numpy() if "divideFlag" in self.data else None
+        cell_rows = row_index["id"].rows(cells, ids)
+        step_rows = self.table["step_rows"]
+        context = sorted_unique(np.concatenate([cell_rows, row_index["id"].rows(parent_ids[cell_rows], ids)] +
+                                               [step_rows[step] for step in self.neighbour_steps(checked, after=False)]), len(ids))
+        children = row_index["parent_id"].rows(ids[context], parent_ids)
+        return find_lineage_problems(step_numbers[context], ids[context], parent_ids[context],
+                                     None if divide_flags is None else divide_flags[context],
+                                     sorted(self.step_map), parent_ids[children], checked, cells)
+
+    # This function returns the steps next to the given ones together with them, sorted
+    # after=False adds only the step before each of them
+    def neighbour_steps(self, steps, after=True):
+        numbers = sorted(self.step_map)
+        found = set()
+        for step in steps:
+            i = bisect.bisect_left(numbers, step)
+            found.update(numbers[max(i - 1, 0):i + 2 if after else i + 1])
+        return sorted(found)
+
+    # This function validates the steps an edit changed again, or every step, and keeps the result in problems
+    # It has to be called before anything flushes the edit, and returns the problems found
+    @timed("check_lineage")
+    def check(self, steps=None):
+        if steps is None:
+            self.problems = {}
+            found = self.validate()
+        else:
+            checked, cells = self.check_scope(steps)
+            checked, cells = set(checked), set(cells.tolist())
+            for step in list(self.problems):
+                kept = [problem for problem in self.problems[step] if step not in checked and problem["id"] not in cells]
+                if kept:
+                    self.problems[step] = kept
+                else:
+                    del self.problems[step]
+            found = self.validate_scope(sorted(checked), np.fromiter(cells, dtype=np.int64, count=len(cells)))
+        for problem in found:
+            self.problems.setdefault(problem["step"], []).append(problem)
+        return found
+
+    # This function writes the dirty cells into the tracking data
+    def flush(self):
+        if self._row_index is not None and self.dirty:
+            rows = np.fromiter(self.dirty, dtype=np.intp, count=len(self.dirty))
+            for index in self._row_index.values():
+                index.update(rows)
+        apply_dirty(self.data, self.dirty)
+
+    # This function writes the tracking data with every edit to a file, the extension picks the format, see save_table
+    # When only some columns were loaded, the columns that were not are read from the file again and put next to them
+    # It raises a ValueError if that file changed since it was loaded, and an OSError if it cannot be read
+    @timed("save_csv")
+    def save(self, path):
+        self.flush()
+        data = self.data
+        if self.partial:
+            if csv_signature(self.path) != self.signature:
+                raise ValueError(f"{self.path} changed on disk since it was loaded, so its other columns cannot be saved with the edits")
+            header = pd.read_csv(self.path, nrows=0).columns.tolist()
+            rest = [column for column in header if column not in self.data]
+            other = pd.read_csv(self.path, usecols=rest) if rest else pd.DataFrame()
+            data = pd.DataFrame({column: (other[column] if column in other else self.data[column]).to_numpy() for column in header})
+        save_table(data, path)
+        if self.partial and os.path.abspath(path) == os.path.abspath(self.path):
+            self.signature = csv_signature(self.path) # The file now holds the edits and the same other columns
+
+
+# This function reads an edits file: a JSON list of edit operations, or one JSON operation per line like the edit journal
+# An operation is {"op": "relabel", "step": 5, "old": 12, "new": 40}, {"op": "reparent", "step": 5, "cell": 40, "parent": 7}
+# or {"op": "change", "step": 5, "old": 12, "new": 40, "parent": 7}, which is what the Change Cell Info button does
+def read_edits(path):
+    with open(path) as file:
+        text = file.read()
+    if text.lstrip().startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+# This function applies the edits to one csv file and saves the result, it runs in a worker process
+def correct_file(path, operations, output, validate):
+    store = LineageStore.load(path)
+    for operation in operations:
+        store.apply(operation)
+    edited = len(store.dirty)
+    problems = store.validate() if validate else []
+    store.save(output)
+    return path, output, edited, problems
+
+
+# This function returns where the corrected copy of a csv file is written
+def output_path(path, output_dir, extension):
+    name = os.path.splitext(os.path.basename(path))[0]
+    if output_dir is None:
+        return os.path.join(os.path.dirname(path), name + "_corrected" + extension)
+    return os.path.join(output_dir, name + extension)
+
+
+# This is the command line entry point that applies one edits file to many csv files in parallel
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply lineage edits to tracking csv files without the GUI")
+    parser.add_argument("edits", help="JSON file with the edit operations, see read_edits")
+    parser.add_argument("csv", nargs="+", help="Tracking csv files to correct")
+    parser.add_argument("--output-dir", help="Directory for the corrected files, by default they are written next to each csv as <name>_corrected")
+    parser.add_argument("--format", choices=["csv", "parquet", "feather"], default="csv", help="Output format, parquet and feather need pyarrow")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--validate", action="store_true", help="Check the corrected lineages and report problems")
+    args = parser.parse_args(argv)
+
+    operations = read_edits(args.edits)
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+    outputs = [output_path(path, args.output_dir, "." + args.format) for path in args.csv]
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(correct_file, path, operations, output, args.validate) for path, output in zip(args.csv, outputs)]
+        for path, future in zip(args.csv, futures):
+            try:
+                _, output, edited, problems = future.result()
+            except Exception as error:
+                print(f"{path}: failed: {error}", file=sys.stderr)
+                failed += 1
+                continue
+            print(f"{path}: {edited} rows edited, saved to {output}")
+            for problem in problems:
+                print(f"  step {problem['step']}, cell {problem['id']}: {problem['problem']}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+import atexit
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+# These are opt-in timing hooks for the hot paths: loading a csv file, building the step_map, decoding images,
+# drawing the cell IDs, editing and saving
+# They are off unless the LINEAGE_PERF environment variable is set, for example: LINEAGE_PERF=1 python cell_lineage_correction.py
+# When on, every hooked call is timed and a summary with the count, p50, p95 and p99 of each operation is printed when the program exits
+# LINEAGE_PERF_OUT=summary.json also writes the summary to a JSON file, which benchmarks/run_suite.py can compare runs with
+# Whether timing is on is decided when this module is imported, so with it off the hooked functions are the plain functions
+
+ENV_VAR = "LINEAGE_PERF"
+OUT_ENV_VAR = "LINEAGE_PERF_OUT"
+ENABLED = os.environ.get(ENV_VAR, "") not in ("", "0")
+PERCENTILES = (50, 95, 99)
+
+_samples = {} # This maps an operation name to the durations of its calls in seconds
+_lock = threading.Lock() # Images are decoded and csv chunks are parsed on worker threads
+
+
+# This function adds the duration of one call of an operation
+def record(name, seconds):
+    if not ENABLED:
+        return
+    with _lock:
+        _samples.setdefault(name, []).append(seconds)
+
+
+# This function returns the time to pass to record_since later, for operations that start and end in different functions
+def clock():
+    return time.perf_counter()
+
+
+# This function records the time since start, a value returned by clock, as one call of an operation
+def record_since(name, start):
+    record(name, time.perf_counter() - start)
+
+
+# This decorator times every call of a function as the operation name
+def timed(name):
+    def decorate(function):
+        if not ENABLED:
+            return function
+        # Qt leaves out the signal arguments a plain slot does not take, like the checked state of a button, the wrapper does the same
+        code = function.__code__
+        limit = None if code.co_flags & inspect.CO_VARARGS else code.co_argcount
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args[:limit], **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+# This context manager times the block it wraps as the operation name
+@contextmanager
+def measure(name):
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+# This function returns the statistics of every operation timed so far, in milliseconds
+def summary():
+    with _lock:
+        samples = {name: np.array(durations) * 1000 for name, durations in _samples.items()}
+    stats = {}
+    for name in sorted(samples):
+        durations = samples[name]
+        stats[name] = {"count": len(durations), "total_ms": float(durations.sum()), "max_ms": float(durations.max())}
+        for percentile, value in zip(PERCENTILES, np.percentile(durations, PERCENTILES).tolist()):
+            stats[name][f"p{percentile}_ms"] = value
+    return stats
+
+
+# This function forgets every timing, so the next summary only holds what runs after it
+def reset():
+    with _lock:
+        _samples.clear()
+
+
+# This function formats a summary as a table with one row per operation
+def format_summary(stats):
+    lines = [f"{'operation':<22} {'count':>7} {'total (ms)':>11} {'p50 (ms)':>10} {'p95 (ms)':>10} {'p99 (ms)':>10} {'max (ms)':>10}"]
+    for name, values in stats.items():
+        lines.append(f"{name:<22} {values['count']:>7} {values['total_ms']:>11.1f} {values['p50_ms']:>10.2f} "
+                     f"{values['p95_ms']:>10.2f} {values['p99_ms']:>10.2f} {values['max_ms']:>10.2f}")
+    return "\n".join(lines)
+
+
+# This function prints the summary to stderr, and writes it as JSON to path or LINEAGE_PERF_OUT when one is set
+def dump(path=None):
+    stats = summary()
+    if not stats:
+        return
+    print(format_summary(stats), file=sys.stderr)
+    path = path or os.environ.get(OUT_ENV_VAR)
+    if path:
+        with open(path, "w") as file:
+            json.dump(stats, file, indent=4)
+
+
+if ENABLED:
+    atexit.register(dump)